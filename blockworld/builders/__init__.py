@@ -1 +1,2 @@
 from .simple_builder import SimpleBuilder
+from .enumerator import TowerEnumerator
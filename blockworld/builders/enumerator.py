@@ -0,0 +1,216 @@
+"""
+Exhaustive enumeration of distinct towers.
+
+Towers are described by keys: sorted tuples of blocks, each an integer
+tuple `(x, y, z, dx, dy, dz)` of its center and dimensions in units of
+`1 / scale`. Two towers are the same if their keys match after mirroring
+across the x or y axis of the base.
+
+Each distinct tower is generated exactly once by canonical augmentation:
+the parent of a tower is the tower without its greatest top block (taken in
+canonical orientation), and a placement is only followed if it is the one
+that leads back to its parent. No global set of seen towers is needed, and
+subtrees can be searched independently.
+"""
+
+import concurrent.futures
+
+import numpy as np
+
+from blockworld.towers import EmptyTower, SimpleTower
+from blockworld.blocks import SimpleBlock
+from blockworld.builders.simple_builder import SimpleBuilder
+
+scale = 100
+
+# Orientations of the 2x1x1 block
+shapes = ((2, 1, 1), (1, 2, 1), (1, 1, 2))
+
+_mirrors = ((1, 1), (-1, 1), (1, -1), (-1, -1))
+
+def block_key(block):
+    """
+    Returns the integer key of a `SimpleBlock`.
+    """
+    pos = np.round(np.asarray(block.pos) * scale).astype(int)
+    dims = np.round(np.asarray(block.dimensions) * scale).astype(int)
+    return tuple(pos.tolist() + dims.tolist())
+
+def canonical(blocks):
+    """
+    Returns the smallest key among the mirror images of a set of blocks.
+    """
+    return min(tuple(sorted((sx * x, sy * y, z, dx, dy, dz)
+                            for x, y, z, dx, dy, dz in blocks))
+               for sx, sy in _mirrors)
+
+def rests_on(upper, lower):
+    """
+    Returns `True` if `upper` sits on `lower` with overlapping faces.
+    """
+    ux, uy, uz, udx, udy, udz = upper
+    lx, ly, lz, ldx, ldy, ldz = lower
+    return (2 * uz - udz == 2 * lz + ldz and
+            2 * abs(ux - lx) < udx + ldx and
+            2 * abs(uy - ly) < udy + ldy)
+
+def tops(blocks):
+    """
+    Returns the blocks that nothing rests on.
+    """
+    return [b for b in blocks if not any(rests_on(o, b) for o in blocks)]
+
+def parent(key):
+    """
+    Returns the canonical key of the parent of a canonical tower key.
+    """
+    top = max(tops(key))
+    return canonical([b for b in key if b != top])
+
+def build(base_dims, blocks):
+    """
+    Creates a tower from an empty base and block keys, such as a canonical
+    tower key.
+
+    Blocks are placed bottom up, so the parents of each block are placed
+    before it.
+    """
+    tower = EmptyTower(base_dims)
+    # by the height of the bottom face
+    for key in sorted(blocks, key = lambda b : 2 * b[2] - b[5]):
+        block = SimpleBlock(np.array(key[3:]) / scale,
+                            pos = np.array(key[:3]) / scale)
+        g = tower.graph
+        parents = [i for i in g if block.isparent(g.nodes[i]['block'])]
+        tower = _push(tower, block, parents)
+    return tower
+
+def _push(tower, block, parents):
+    """
+    Adds a block to the graph of `tower` in place, returning a tower that
+    shares the graph.
+    """
+    g = tower.graph
+    b_id = len(g)
+    g.add_node(b_id, block = block)
+    for p in parents:
+        g.add_edge(p, b_id)
+    return SimpleTower(g)
+
+def _pop(tower):
+    g = tower.graph
+    g.remove_node(len(g) - 1)
+
+
+class TowerEnumerator:
+
+    """
+    Enumerates every distinct tower of up to `k` blocks on a base.
+
+    Attributes:
+
+      - base_dims (tuple): Dimensions of the base.
+      - k (int): Maximum number of blocks.
+      - shapes ([tuple]): Block dimensions to place.
+      - builder (`SimpleBuilder`): Finds valid placements; its `step` sets
+        the grid resolution.
+
+    Example:
+
+        enum = TowerEnumerator((2, 1), 2)
+        for key in enum.run_parallel(workers = 8):
+            tower = build((2, 1), key)
+    """
+
+    def __init__(self, base_dims, k, shapes = shapes, builder = None):
+        self.base_dims = tuple(base_dims)
+        self.k = k
+        self.shapes = [tuple(s) for s in shapes]
+        if builder is None:
+            builder = SimpleBuilder(memo_size = 0)
+        self.builder = builder
+
+    # Methods #
+
+    def children(self, tower, blocks, key):
+        """
+        Generator over the placements on `tower` leading to new towers
+        whose parent is `key`.
+
+        Returns:
+            Tuples of (child key, block key, block, parents).
+        """
+        seen = set()
+        for dims in self.shapes:
+            block = SimpleBlock(dims)
+            for parents, b in self.builder.find_placements(tower, block):
+                bk = block_key(b)
+                child = canonical(blocks + [bk])
+                if child in seen or parent(child) != key:
+                    continue
+                seen.add(child)
+                yield child, bk, b, parents
+
+    def search(self, tower, blocks, key, depth):
+        """
+        Depth-first generator over the keys of the towers below `tower`,
+        which has `depth` blocks.
+        """
+        if depth >= self.k:
+            return
+        for child, bk, b, parents in self.children(tower, blocks, key):
+            yield child
+            t = _push(tower, b, parents)
+            yield from self.search(t, blocks + [bk], child, depth + 1)
+            _pop(tower)
+
+    def run(self, prefix = ()):
+        """
+        Generator over the canonical keys of all towers, or of all towers
+        below the tower built from the block keys in `prefix`.
+        """
+        prefix = list(prefix)
+        tower = build(self.base_dims, prefix)
+        key = canonical(prefix) if len(prefix) > 0 else ()
+        yield from self.search(tower, prefix, key, len(prefix))
+
+    def prefixes(self, depth):
+        """
+        Splits the search at `depth`.
+
+        Returns:
+            The keys of towers with fewer than `depth` blocks and the
+            placement sequences of the towers with `depth` blocks, whose
+            subtrees hold the remaining towers.
+        """
+        shallow = []
+        frontier = [[]]
+        for d in range(depth):
+            nxt = []
+            for prefix in frontier:
+                tower = build(self.base_dims, prefix)
+                key = canonical(prefix) if len(prefix) > 0 else ()
+                for child, bk, _, _ in self.children(tower, prefix, key):
+                    nxt.append(prefix + [bk])
+            frontier = nxt
+            if d + 1 < depth:
+                shallow.extend(canonical(p) for p in frontier)
+        return shallow, frontier
+
+    def run_parallel(self, workers = None, depth = 1):
+        """
+        Enumerates towers with the subtrees at `depth` searched in parallel.
+
+        Returns:
+            A generator over canonical keys, in no particular order.
+        """
+        depth = min(depth, self.k)
+        shallow, frontier = self.prefixes(depth)
+        yield from shallow
+        with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+            futures = [executor.submit(_subtree, self, p) for p in frontier]
+            for f in concurrent.futures.as_completed(futures):
+                yield from f.result()
+
+def _subtree(enum, prefix):
+    return [canonical(prefix)] + list(enum.run(prefix))
@@ -1,12 +1,14 @@
 import copy
 import pprint
 import functools
+from collections import OrderedDict
+
 import numpy as np
 
 from shapely import geometry, affinity
 # from shapely.prepared import prep
 
-from blockworld.utils import math_2d, geotools
+from blockworld.utils import math_2d, geotools, profiling
 from blockworld.builders.builder import Builder
 
 
@@ -21,11 +23,29 @@ class SimpleBuilder(Builder):
     Attributes:
         max_blocks (int): The maximum number of blocks to be added.
         max_height (int): The maximum height to be added.
+        sampling (str): How placements are chosen. 'enumerate' validates
+            every placement with `find_placements`; 'lazy' validates random
+            candidates until one is valid (see `sample_placement`).
+        max_tries (int): Candidates validated lazily before enumerating
+            the rest.
+        memo_size (int): Number of placement sets remembered (see
+            `placements`). `0` disables memoization.
+        step (float): Spacing of the grid of candidate positions.
+        hits (int): Placement sets found in memory.
+        misses (int): Placement sets computed.
 
     """
 
-    def __init__(self, max_height = 100):
+    samplers = ['enumerate', 'lazy']
+
+    def __init__(self, max_height = 100, sampling = 'enumerate',
+                 max_tries = 50, memo_size = 1024, step = 0.1):
         self.max_height = max_height
+        self.step = step
+        self.sampling = sampling
+        self.max_tries = max_tries
+        self.memo_size = memo_size
+        self.clear_memo()
 
 
     # Properties #
@@ -41,8 +61,24 @@ class SimpleBuilder(Builder):
             raise ValueError(msg)
         self._max_height = v
 
+    @property
+    def sampling(self):
+        return self._sampling
+
+    @sampling.setter
+    def sampling(self, v):
+        if not v in self.samplers:
+            raise ValueError('Unknown sampling {}'.format(v))
+        self._sampling = v
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return 0.0 if total == 0 else self.hits / total
+
     # Methods #
 
+    @profiling.profile('SimpleBuilder.find_placements')
     def find_placements(self, tower, block):
         """
         Enumerates the geometrically valid positions for
@@ -86,7 +122,7 @@ class SimpleBuilder(Builder):
         positions = []
         parents = []
         # The base of the tower
-        base_grid = geotools.make_grid(tower.base)
+        base_grid = geotools.make_grid(tower.base, step = self.step)
         all_blocks, levels = tower.levels()
         # Each z-normal surface currently available on the tower
         for (level_z, level_blocks) in levels:
@@ -99,14 +135,21 @@ class SimpleBuilder(Builder):
             # Find the intersect between the grid of possible points and z-layer
             grid = base_grid.intersection(layer.envelope)
             # Find all points on grid where the new block would not collide
-            proposals = geotools.propose_placements(block, grid, level_z)
+            with profiling.span('find_placements.proposals'):
+                proposals = geotools.propose_placements(block, grid, level_z)
 
             locally_stable_f = lambda p : geotools.local_stability(p, layer)
-            locally_stable = list(filter(locally_stable_f, proposals))
+            with profiling.span('find_placements.stability'):
+                locally_stable = list(filter(locally_stable_f, proposals))
 
             collision_f = lambda p : all(
                 map(lambda b : not p.collides(b), all_blocks))
-            no_collision = list(filter(collision_f, locally_stable))
+            with profiling.span('find_placements.collision'):
+                no_collision = list(filter(collision_f, locally_stable))
+
+            profiling.count('find_placements.proposals', len(proposals))
+            profiling.count('find_placements.stable', len(locally_stable))
+            profiling.count('find_placements.valid', len(no_collision))
 
             level_parents = [[i for i,b in level_blocks if pot.isparent(b)]
                              for pot in no_collision]
@@ -116,6 +159,103 @@ class SimpleBuilder(Builder):
 
         return zip(parents, positions)
 
+    def clear_memo(self):
+        self._memo = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def signature(self, tower, block):
+        """
+        Returns a hashable description of the geometry that determines the
+        placements of `block` on `tower`.
+        """
+        bs = tower.blocks
+        blocks = tuple((int(k), tuple(np.round(bs[k]['block'].pos, 3)),
+                        tuple(bs[k]['block'].dimensions)) for k in sorted(bs))
+        return blocks, tuple(block.dimensions)
+
+    def placements(self, tower, block):
+        """
+        Returns the list of `find_placements`, remembering the last
+        `memo_size` results by `signature`.
+        """
+        if self.memo_size <= 0:
+            return list(self.find_placements(tower, block))
+        key = self.signature(tower, block)
+        if key in self._memo:
+            self._memo.move_to_end(key)
+            self.hits += 1
+            profiling.count('SimpleBuilder.memo_hits')
+            return self._memo[key]
+        self.misses += 1
+        profiling.count('SimpleBuilder.memo_misses')
+        valids = list(self.find_placements(tower, block))
+        self._memo[key] = valids
+        if len(self._memo) > self.memo_size:
+            self._memo.popitem(last = False)
+        return valids
+
+    def candidates(self, tower):
+        """
+        Returns every grid point on every tower level as arrays of level
+        indices and xy points, without validating them.
+        """
+        base_grid = geotools.grid_points(tower.base, step = self.step)
+        all_blocks, levels = tower.levels()
+        index = []
+        points = []
+        for i, (_, level_blocks) in enumerate(levels):
+            bounds = geometry.MultiPolygon(
+                [b.surface for _, b in level_blocks]).bounds
+            grid = base_grid[geotools.in_bounds(base_grid, bounds)]
+            index.append(np.full(len(grid), i))
+            points.append(grid)
+        index = np.concatenate(index)
+        return all_blocks, levels, index, np.concatenate(points)
+
+    @profiling.profile('SimpleBuilder.sample_placement')
+    def sample_placement(self, tower, block):
+        """
+        Draws a placement uniformly from those `find_placements` returns,
+        validating candidates only as needed.
+
+        Candidates are validated in random order and the first valid one is
+        taken. After `max_tries` invalid candidates, the remaining ones are
+        all validated and one of the valid ones is drawn, which keeps the
+        draw uniform over valid placements.
+
+        Returns:
+           A tuple `(parents, block)`, or `None` if there is no placement.
+        """
+        all_blocks, levels, index, points = self.candidates(tower)
+        layers = [geometry.MultiPolygon([b.surface for _, b in lb])
+                  for _, lb in levels]
+
+        def validate(c):
+            level_z, level_blocks = levels[index[c]]
+            p = block.moveto(geometry.Point(points[c]), level_z)
+            if not geotools.local_stability(p, layers[index[c]]):
+                return None
+            if any(p.collides(b) for b in all_blocks):
+                return None
+            return [i for i, b in level_blocks if p.isparent(b)], p
+
+        order = np.random.permutation(len(points))
+        profiling.count('sample_placement.candidates', len(points))
+        for tries, c in enumerate(order):
+            if tries == self.max_tries:
+                break
+            placement = validate(c)
+            if not placement is None:
+                profiling.count('sample_placement.validated', tries + 1)
+                return placement
+        rest = [validate(c) for c in order[self.max_tries:]]
+        profiling.count('sample_placement.validated', len(order))
+        valids = [p for p in rest if not p is None]
+        if len(valids) == 0:
+            return None
+        return valids[np.random.choice(len(valids))]
+
     def __call__(self, base_tower, blocks, stability = True):
         """
         Builds a tower ontop of the given base.
@@ -129,11 +269,18 @@ class SimpleBuilder(Builder):
             if t_tower.height >= self.max_height:
                 break
 
-            valids = list(self.find_placements(t_tower, block))
-            if len(valids) == 0:
+            if self.sampling == 'lazy':
+                placement = self.sample_placement(t_tower, block)
+            else:
+                valids = self.placements(t_tower, block)
+                placement = None
+                if len(valids) > 0:
+                    placement = valids[np.random.choice(len(valids))]
+            if placement is None:
                 print('Could not place any more blocks')
                 break
-            parents, b = valids[np.random.choice(len(valids))]
-            t_tower = t_tower.place_block(b, parents)
+            parents, b = placement
+            # remembered placements are shared between towers
+            t_tower = t_tower.place_block(copy.deepcopy(b), list(parents))
 
         return t_tower
@@ -0,0 +1,195 @@
+"""
+Cascaded acceptance tests for generated towers.
+
+Criteria are checked from cheapest to most expensive so that physics is
+only run on towers that can still pass:
+
+1. geometry: block count and height
+2. analytic: `stability.classify` of the unperturbed tower
+3. physics: displacement over a short simulation
+4. ke: mean KE under perturbation (`TowerEntropy.analyze`)
+
+Example:
+
+    cascade = Cascade(blocks = 5, height = (4, None), stable = True,
+                      ke = (None, 0.1))
+    for tower in cascade.generate(gen, (2, 1), k = 5, n = 100):
+        ...
+    print(cascade.report())
+"""
+
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from blockworld.simulation import physics, stability, tower_scene
+
+class Cascade:
+
+    """
+    Accepts towers that meet all given criteria.
+
+    Ranges are `(min, max)` tuples where either bound may be `None`.
+    Stages without criteria are skipped.
+
+    Attributes:
+
+      - blocks (int or tuple, optional): Number of blocks (excluding the
+        base) or range thereof.
+      - height (tuple, optional): Range of tower height.
+      - stable (bool, optional): Whether the unperturbed tower must stand
+        (`True`) or fall (`False`).
+      - ke (tuple, optional): Range of mean KE under perturbation.
+      - frames (int): Frames of the short simulation used for `stable`.
+      - tol (float): Displacement above which a block has fallen.
+      - fidelity (str): One of `tower_scene.presets` for that simulation.
+      - entropy (dict): Keyword arguments for `TowerEntropy`.
+      - stats (OrderedDict): Per stage number of towers seen, number
+        rejected and total seconds.
+    """
+
+    stages = ('geometry', 'analytic', 'physics', 'ke')
+
+    def __init__(self, blocks = None, height = None, stable = None, ke = None,
+                 frames = 60, tol = 0.1, fidelity = 'standard',
+                 entropy = None):
+        if isinstance(blocks, int):
+            blocks = (blocks, blocks)
+        self.blocks = blocks
+        self.height = height
+        self.stable = stable
+        self.ke = ke
+        self.frames = frames
+        self.tol = tol
+        self.fidelity = fidelity
+        self.entropy = {} if entropy is None else dict(entropy)
+        self.reset()
+
+    @classmethod
+    def from_dict(cls, d):
+        """
+        Creates a cascade from a `dict` of keyword arguments, as read
+        from JSON.
+        """
+        d = dict(d)
+        for k in ('height', 'ke', 'blocks'):
+            if isinstance(d.get(k), list):
+                d[k] = tuple(d[k])
+        return cls(**d)
+
+    # Properties #
+
+    @property
+    def fidelity(self):
+        return self._fidelity
+
+    @fidelity.setter
+    def fidelity(self, v):
+        if not v in tower_scene.presets:
+            raise ValueError('Unknown fidelity {}'.format(v))
+        self._fidelity = v
+
+    # Methods #
+
+    def reset(self):
+        self.stats = OrderedDict((s, {'seen' : 0, 'rejected' : 0,
+                                      'time' : 0.0}) for s in self.stages)
+
+    def active(self, stage):
+        """
+        Returns `True` if any criterion is checked at `stage`.
+        """
+        if stage == 'geometry':
+            return not (self.blocks is None and self.height is None)
+        if stage in ('analytic', 'physics'):
+            return not self.stable is None
+        return not self.ke is None
+
+    def geometry(self, tower):
+        return (_within(len(tower), self.blocks) and
+                _within(tower.height, self.height))
+
+    def analytic(self, tower):
+        # towers whose graph lacks a support are `UNKNOWN`, not rejected
+        label = stability.classify(tower)[0]
+        if self.stable:
+            return label != stability.UNSTABLE
+        return label != stability.STABLE
+
+    def physics(self, tower):
+        keys = list(tower.blocks.keys())[1:]
+        with tower_scene.TowerPhysics(tower.serialize()) as scene:
+            trace = scene.get_trace(self.frames, keys, fidelity = self.fidelity)
+        pos = trace['position']
+        moved = np.max(np.linalg.norm(pos[-1] - pos[0], axis = -1))
+        return (moved < self.tol) == self.stable
+
+    def kinetic(self, tower):
+        ke, _, _ = physics.TowerEntropy(**self.entropy).analyze(tower)
+        return _within(ke, self.ke)
+
+    def __call__(self, tower):
+        """
+        Returns `True` if `tower` passes every active stage.
+        """
+        checks = {'geometry' : self.geometry, 'analytic' : self.analytic,
+                  'physics' : self.physics, 'ke' : self.kinetic}
+        for stage in self.stages:
+            if not self.active(stage):
+                continue
+            s = self.stats[stage]
+            s['seen'] += 1
+            start = time.perf_counter()
+            passed = checks[stage](tower)
+            s['time'] += time.perf_counter() - start
+            if not passed:
+                s['rejected'] += 1
+                return False
+        return True
+
+    def generate(self, generator, base, k = 1, n = 1, max_attempts = None):
+        """
+        Samples towers from a `Generator` until `n` are accepted.
+
+        Arguments:
+            generator (`Generator`): Source of towers.
+            base (`Tower` or tuple): Base to build on.
+            k (int, optional): Blocks to add per tower.
+            n (int, optional): Number of towers to accept.
+            max_attempts (int, optional): Gives up after this many samples.
+
+        Returns:
+            A generator over `(tower, configurations)` as `Generator`.
+        """
+        accepted = 0
+        attempts = 0
+        while accepted < n:
+            if not max_attempts is None and attempts >= max_attempts:
+                break
+            attempts += 1
+            tower, configurations = next(generator(base, k = k, n = 1))
+            if self(tower):
+                accepted += 1
+                yield tower, configurations
+
+    def report(self):
+        """
+        Returns the rejection rate and mean time of each active stage.
+        """
+        result = OrderedDict()
+        for stage, s in self.stats.items():
+            if s['seen'] == 0:
+                continue
+            result[stage] = {'seen' : s['seen'],
+                             'rejected' : s['rejected'],
+                             'rate' : s['rejected'] / s['seen'],
+                             'mean_time' : s['time'] / s['seen']}
+        return result
+
+
+def _within(value, bounds):
+    if bounds is None:
+        return True
+    lo, hi = bounds
+    return (lo is None or value >= lo) and (hi is None or value <= hi)
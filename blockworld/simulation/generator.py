@@ -5,19 +5,24 @@ from collections import OrderedDict
 import numpy as np
 
 from blockworld import blocks, towers, builders
-from blockworld.simulation.substances import Substance
+from blockworld.utils import profiling
+from blockworld.simulation.substances import Substance, MaterialTable
 
 class Generator:
 
     """
     Controls generation of towers.
+
+    `sampling` selects how `SimpleBuilder` chooses placements
+    ('enumerate' or 'lazy').
     """
 
     stability_types = ['local', 'global']
     unknowns = ['H', 'L']
 
-    def __init__(self, materials, stability):
+    def __init__(self, materials, stability, sampling = 'enumerate'):
         self.materials = materials
+        self.sampling = sampling
         self.builder = stability
 
     # Properties and Setters
@@ -34,11 +39,16 @@ class Generator:
         else:
             self._materials = list(mats)
             self._mat_ps = ps
+            self._table = MaterialTable(mats)
 
     @property
     def mat_ps(self):
         return self._mat_ps
 
+    @property
+    def table(self):
+        return self._table
+
     @property
     def builder(self):
         return self._builder
@@ -49,7 +59,7 @@ class Generator:
            (not s in self.stability_types):
             raise ValueError('Unkown builder type.')
 
-        self._builder = builders.SimpleBuilder()
+        self._builder = builders.SimpleBuilder(sampling = self.sampling)
 
     @property
     def base(self):
@@ -92,21 +102,48 @@ class Generator:
         new_tower = self.builder(base, blocks)
         return new_tower
 
-    def sample_materials(self, tower):
+    def sample_substances(self, shape):
+        """
+        Draws material codes and properties (see `MaterialTable`) for an
+        array of blocks, such as `(towers, blocks)`, at once.
+        """
+        codes = self.table.sample(shape, p = self.mat_ps)
+        return codes, self.table.properties(codes)
+
+    @profiling.profile('Generator.sample_materials')
+    def sample_materials(self, tower, codes = None, props = None):
         """
         Procedurally assigns substance and appearance to each block
         in a tower structure.
+
+        Pre-drawn `codes` and `props` from `sample_substances` may be given.
         """
+        if codes is None:
+            codes, props = self.sample_substances(len(tower))
         tower = copy.deepcopy(tower)
-        materials = np.random.choice(self.materials,
-                                     size = len(tower),
-                                     p = self.mat_ps)
-
-        substances = [Substance(m).serialize() for m in materials]
-        tower = tower.apply_feature('substance', substances)
-        tower = tower.apply_feature('appearance', materials)
+        substances = self.table.serialize(props)
+        for i in range(len(tower)):
+            block = tower.blocks[i + 1]
+            block['substance'] = substances[i]
+            block['appearance'] = self.table.names[codes[i]]
         return tower
 
+    def sample_materials_batch(self, towers):
+        """
+        Assigns materials to a batch of towers, with a single draw for all
+        towers of the same size.
+        """
+        towers = list(towers)
+        result = [None] * len(towers)
+        sizes = np.array([len(t) for t in towers], dtype = int)
+        for size in np.unique(sizes):
+            idx = np.flatnonzero(sizes == size)
+            codes, props = self.sample_substances((len(idx), size))
+            for i, c, p in zip(idx, codes, props):
+                result[i] = self.sample_materials(towers[i], codes = c,
+                                                  props = p)
+        return result
+
     def sample_tower(self, base, n):
         """
         Procedurally generates a tower.
@@ -116,6 +153,51 @@ class Generator:
         return tower
 
 
+    def sweep(self, tower):
+        """
+        Enumerates tower configurations as deltas against `tower`.
+
+        For each block and each unknown material, two alternates are
+        described: a congruent one, where the block's substance matches its
+        new appearance, and an incongruent one, where it is the next unknown
+        material.
+
+        Arguments:
+            tower (`Tower`) : Template tower.
+
+        Returns:
+            A list of `dict` of the form
+
+            { 'block' : block id,
+              'appearance' : material name,
+              'congruent' : bool,
+              'substance' : serialized `Substance` }
+        """
+        deltas = []
+        n_mats = len(self.unknowns)
+        for block_id in tower.ordered_blocks:
+            for mat_i in range(n_mats):
+                mat = self.unknowns[mat_i]
+                other = self.unknowns[(mat_i + 1) % n_mats]
+                for congruent, sub in ((True, mat), (False, other)):
+                    deltas.append({
+                        'block' : int(block_id),
+                        'appearance' : mat,
+                        'congruent' : congruent,
+                        'substance' : Substance(sub).serialize()
+                    })
+        return deltas
+
+    def apply(self, tower, delta):
+        """
+        Returns a copy of `tower` with a `sweep` delta applied.
+        """
+        tower = copy.deepcopy(tower)
+        block = tower.blocks[delta['block']]
+        block['appearance'] = delta['appearance']
+        block['substance'] = delta['substance']
+        return tower
+
     def configurations(self, tower):
         """
         Generator for different tower configurations.
@@ -134,23 +216,17 @@ class Generator:
 
             { 'mat_i' : (congruent, incongruent)
               ...
+
+        See `sweep` for a representation that avoids copying the tower.
         """
-        subs = tower.extract_feature('substance')
-        n_blocks = len(tower)
-        for block_i in range(n_blocks):
+        # each block has a (congruent, incongruent) pair per unknown
+        deltas = iter(self.sweep(tower))
+        for _ in range(len(tower)):
             d = {}
-            for mat_i in range(len(self.unknowns)):
-                mt = copy.deepcopy(subs)
-                mt[block_i] = self.unknowns[mat_i]
-                base = tower.apply_feature('appearance', mt)
-                cong_tower = base.apply_feature('substance', mt)
-
-                mti = copy.deepcopy(subs)
-                mti[block_i] = self.unknowns[(mat_i + 1) % len(self.unknowns)]
-                inco_tower = base.apply_feature('substance', mti)
-
-                d[self.unknowns[mat_i]] = (cong_tower, inco_tower)
-
+            for _ in self.unknowns:
+                cong, inco = next(deltas), next(deltas)
+                d[cong['appearance']] = (self.apply(tower, cong),
+                                         self.apply(tower, inco))
             yield d
 
 
@@ -0,0 +1,196 @@
+"""
+Runs external render and encode processes concurrently with asyncio.
+
+Example:
+
+    runner = JobRunner(concurrency = 4, timeout = 600, retries = 1,
+                       log_dir = 'logs')
+    runner.render('scene.json', 'trace', 'out', render_mode = 'motion')
+    runner.encode('out/render/motion/%d.png', 'motion.mp4', extend = 2,
+                  n_frames = 120)
+    for job in runner.run():
+        print(job.name, job.status, job.elapsed)
+"""
+
+import os
+import time
+import shlex
+import asyncio
+
+from blockworld.simulation import movie, render_scheduler
+
+class Job:
+
+    """
+    An external command and the outcome of running it.
+
+    Attributes:
+
+      - name (str): Identifier used for the log file.
+      - cmd ([str]): Command and arguments.
+      - timeout (float, optional): Seconds before an attempt is killed.
+      - retries (int): Attempts after the first.
+      - status (str): 'pending', 'done', 'failed' or 'timeout'.
+      - returncode (int, optional): Exit code of the last attempt, `None`
+        if the command could not be started.
+      - attempts (int): Number of attempts made.
+      - elapsed (float): Seconds spent over all attempts.
+      - output (bytes): Combined stdout and stderr of the last attempt.
+    """
+
+    def __init__(self, name, cmd, timeout = None, retries = 0):
+        self.name = name
+        self.cmd = list(cmd)
+        self.timeout = timeout
+        self.retries = retries
+        self.status = 'pending'
+        self.returncode = None
+        self.attempts = 0
+        self.elapsed = 0.0
+        self.output = b''
+
+    def __repr__(self):
+        return '<Job {0!s} {1!s}>'.format(self.name, self.status)
+
+
+class JobRunner:
+
+    """
+    Runs queued jobs with at most `concurrency` processes at a time.
+
+    Attributes:
+
+      - concurrency (int): Maximum number of concurrent processes.
+      - timeout (float, optional): Default timeout of each attempt.
+      - retries (int): Default number of retries of failed jobs.
+      - backoff (float): Seconds to wait before the n-th retry, times n.
+      - log_dir (str, optional): If given, the output of each attempt is
+        written to `<log_dir>/<name>.log`.
+      - jobs ([`Job`]): Submitted jobs.
+    """
+
+    def __init__(self, concurrency = 4, timeout = None, retries = 0,
+                 backoff = 1.0, log_dir = None):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.log_dir = log_dir
+        self.jobs = []
+
+    # Methods #
+
+    def submit(self, cmd, name = None, timeout = None, retries = None):
+        """
+        Queues a command, given as a list or a shell-like string.
+
+        Returns:
+            The queued `Job`.
+        """
+        if isinstance(cmd, str):
+            cmd = shlex.split(cmd)
+        if name is None:
+            name = 'job_{0:d}'.format(len(self.jobs))
+        job = Job(name, cmd,
+                  timeout = self.timeout if timeout is None else timeout,
+                  retries = self.retries if retries is None else retries)
+        self.jobs.append(job)
+        return job
+
+    def render(self, scene, trace, out, name = None, cmd = None, **options):
+        """
+        Queues a `render.py` job. See `render_command`.
+        """
+        return self.submit(render_command(scene, trace, out, cmd = cmd,
+                                          **options), name = name)
+
+    def encode(self, source, out, name = None, **kwargs):
+        """
+        Queues an ffmpeg job. See `movie.encode_command`.
+        """
+        return self.submit(movie.encode_command(source, out, **kwargs),
+                           name = name)
+
+    def run(self):
+        """
+        Runs all pending jobs and returns them.
+        """
+        return asyncio.run(self.run_async())
+
+    async def run_async(self):
+        sem = asyncio.Semaphore(self.concurrency)
+        pending = [j for j in self.jobs if j.status == 'pending']
+        await asyncio.gather(*(self._run(job, sem) for job in pending))
+        return pending
+
+    async def _run(self, job, sem):
+        while True:
+            async with sem:
+                await self._attempt(job)
+            if job.status == 'done' or job.attempts > job.retries:
+                return
+            await asyncio.sleep(self.backoff * job.attempts)
+
+    async def _attempt(self, job):
+        job.attempts += 1
+        start = time.perf_counter()
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *job.cmd, stdout = asyncio.subprocess.PIPE,
+                stderr = asyncio.subprocess.STDOUT)
+        except OSError as e:
+            # such as a missing executable
+            job.output = (str(e) + '\n').encode('utf-8')
+            job.returncode = None
+            job.status = 'failed'
+            job.elapsed += time.perf_counter() - start
+            self._log(job)
+            return
+        try:
+            job.output, _ = await asyncio.wait_for(proc.communicate(),
+                                                   job.timeout)
+            job.returncode = proc.returncode
+            job.status = 'done' if proc.returncode == 0 else 'failed'
+        except asyncio.TimeoutError:
+            proc.kill()
+            job.output, _ = await proc.communicate()
+            job.returncode = proc.returncode
+            job.status = 'timeout'
+        job.elapsed += time.perf_counter() - start
+        self._log(job)
+
+    def _log(self, job):
+        if self.log_dir is None:
+            return
+        if not os.path.isdir(self.log_dir):
+            os.makedirs(self.log_dir)
+        path = os.path.join(self.log_dir, job.name + '.log')
+        with open(path, 'ab') as f:
+            header = '# attempt {0:d}: {1!s} ({2!s})\n'.format(
+                job.attempts, job.status, job.returncode)
+            f.write(header.encode('utf-8'))
+            f.write(job.output)
+
+
+def render_command(scene, trace, out, cmd = None, **options):
+    """
+    Builds a `render.py` command.
+
+    `options` are further `render.py` arguments: `True` adds a flag, lists
+    add several values and `False` or `None` are left out.
+    """
+    if cmd is None:
+        cmd = render_scheduler.blender
+    args = shlex.split(cmd)
+    args += ['--scene', scene, '--trace', trace, '--out', out]
+    for k, v in options.items():
+        if v is None or v is False:
+            continue
+        args.append('--' + k)
+        if v is True:
+            continue
+        if isinstance(v, (list, tuple)):
+            args += [str(x) for x in v]
+        else:
+            args.append(str(v))
+    return args
@@ -0,0 +1,181 @@
+"""
+Streams frames into a single ffmpeg process.
+
+Frames are piped as raw RGB so no intermediate images are written, and the
+hold at the end of the movie (with an optional overlay) is produced in the
+same encoding pass.
+"""
+
+import shlex
+import subprocess
+
+import numpy as np
+
+encoder = '-pix_fmt yuv420p -vcodec libx264'
+
+def to_bytes(image):
+    """
+    Converts a float or uint8 RGB(A) image to packed RGB24 bytes.
+    """
+    image = np.asarray(image)
+    if image.dtype != np.uint8:
+        image = np.round(np.clip(image, 0.0, 1.0) * 255).astype(np.uint8)
+    return np.ascontiguousarray(image[..., :3]).tobytes()
+
+def composite(image, overlay):
+    """
+    Draws `overlay` centered over `image`, blending with its alpha channel
+    if it has one.
+    """
+    image = np.array(image, dtype = np.float32)
+    overlay = np.asarray(overlay, dtype = np.float32)
+    if overlay.max() > 1.0:
+        overlay = overlay / 255.0
+    h, w = overlay.shape[:2]
+    H, W = image.shape[:2]
+    if h > H or w > W:
+        raise ValueError('Overlay is larger than the frame')
+    y = (H - h) // 2
+    x = (W - w) // 2
+    region = image[y:y + h, x:x + w, :3]
+    if overlay.shape[2] == 4:
+        alpha = overlay[..., 3:]
+        region[:] = alpha * overlay[..., :3] + (1.0 - alpha) * region
+    else:
+        region[:] = overlay[..., :3]
+    return image
+
+def encode_command(source, out, fps = 60, extend = 0, image = None,
+                   n_frames = None):
+    """
+    Builds an ffmpeg command encoding a numbered image sequence.
+
+    The last frame is held for `extend` seconds with `image` shown over
+    the held frames, all in a single pass.
+
+    Arguments:
+        source (str): Image sequence pattern, such as `frames/%d.png`.
+        out (str): Path of the movie.
+        fps (int, optional): Frame rate.
+        extend (float, optional): Seconds to hold the last frame.
+        image (str, optional): Path of the overlay image.
+        n_frames (int, optional): Frames in `source`. Required for `image`.
+
+    Returns:
+        The command as a list of arguments.
+    """
+    cmd = ['ffmpeg', '-y', '-r', str(fps), '-i', source]
+    filters = []
+    if extend > 0:
+        pad = 'v' if image is None else 'p'
+        filters.append(('[0:v]tpad=stop_mode=clone:' +\
+                        'stop_duration={0!s}[{1!s}]').format(extend, pad))
+        if not image is None:
+            if n_frames is None:
+                raise ValueError('`n_frames` is required with `image`')
+            cmd += ['-i', image]
+            filters.append(('[p][1:v]overlay=(W-w)/2:(H-h)/2:' +\
+                            'enable=gte(t\\,{0:f})[v]').format(
+                                n_frames / fps))
+    if len(filters) > 0:
+        cmd += ['-filter_complex', ';'.join(filters), '-map', '[v]']
+    return cmd + shlex.split(encoder) + [out]
+
+class MovieWriter:
+
+    """
+    Encodes frames to a movie as they are produced.
+
+    Attributes:
+
+      - out (str): Path of the movie.
+      - fps (int): Frame rate.
+      - extend (float): Seconds to hold the last frame.
+      - overlay (np.ndarray, optional): Image drawn over the held frames.
+      - frames (int): Number of frames written so far.
+
+    Example:
+
+        with MovieWriter('tower.mp4', extend = 2) as movie:
+            for image in pv.frames(scene, trace):
+                movie.write(image)
+    """
+
+    def __init__(self, out, fps = 60, extend = 0, overlay = None,
+                 cmd = 'ffmpeg'):
+        self.out = out
+        self.fps = fps
+        self.extend = extend
+        self.overlay = overlay
+        self.cmd = cmd
+        self.frames = 0
+        self._proc = None
+        self._shape = None
+        self._last = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *_):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _open(self, shape):
+        height, width = shape[:2]
+        # libx264 requires even dimensions
+        cmd = ('{0!s} -y -loglevel error -f rawvideo -pix_fmt rgb24 ' +\
+               '-s {1:d}x{2:d} -r {3:d} -i - {4!s} ' +\
+               '-vf pad=ceil(iw/2)*2:ceil(ih/2)*2 {5!s}').format(
+                   self.cmd, width, height, self.fps, encoder,
+                   shlex.quote(self.out))
+        self._proc = subprocess.Popen(shlex.split(cmd),
+                                      stdin = subprocess.PIPE)
+        self._shape = shape
+
+    def write(self, image):
+        """
+        Appends a frame. All frames must have the same shape.
+        """
+        image = np.asarray(image)
+        if self._proc is None:
+            self._open(image.shape)
+        elif image.shape != self._shape:
+            raise ValueError('Frame shape {} differs from {}'.format(
+                image.shape, self._shape))
+        self._proc.stdin.write(to_bytes(image))
+        self._last = image
+        self.frames += 1
+
+    def close(self):
+        """
+        Writes the held frames and waits for ffmpeg to finish.
+        """
+        if self._proc is None:
+            return
+        n = int(round(self.extend * self.fps))
+        if n > 0:
+            last = self._last
+            if not self.overlay is None:
+                last = composite(last, self.overlay)
+            data = to_bytes(last)
+            for _ in range(n):
+                self._proc.stdin.write(data)
+            self.frames += n
+        self._proc.stdin.close()
+        code = self._proc.wait()
+        self._proc = None
+        if code != 0:
+            raise subprocess.CalledProcessError(code, self.cmd)
+
+    def abort(self):
+        if self._proc is None:
+            return
+        try:
+            self._proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        self._proc.kill()
+        self._proc.wait()
+        self._proc = None
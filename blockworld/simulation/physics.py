@@ -3,32 +3,83 @@ import pprint
 import numpy as np
 
 from blockworld import towers, blocks
-from blockworld.simulation import tower_scene
+from blockworld.utils import profiling
+from blockworld.simulation import tower_scene, stability, substances
 
 class TowerEntropy:
 
     """
     Performs "entropy" analysis on towers.
+
+    By default each tower is analyzed with a fixed number of `samples`
+    perturbations. If `ci_width` is given, perturbations are instead drawn in
+    batches of `batch` until the `z` confidence interval of the mean KE is
+    narrower than `ci_width`, using between `min_samples` and `samples`
+    perturbations.
+
+    If `prescreen` is set, perturbations that `stability.classify` deems
+    statically stable (with margin `prescreen`) are assigned zero KE
+    without simulation.
+
+    `fidelity` selects one of the `tower_scene.presets` for simulation.
+
+    If a `utils.cache.Cache` is given as `cache`, KE results are stored in it
+    keyed by the serialized tower, the state of the random number generator
+    used for perturbations and the analysis parameters.
     """
 
-    def __init__(self, noise = 0.5, dims = [0, 1], frames = 30):
+    def __init__(self, noise = 0.5, dims = [0, 1], frames = 30, samples = 50,
+                 ci_width = None, batch = 10, min_samples = 10, z = 1.96,
+                 prescreen = None, fidelity = 'standard', cache = None):
         self.noise = noise
         self.dims = dims
         self.frames = frames
+        self.samples = samples
+        self.ci_width = ci_width
+        self.batch = batch
+        self.min_samples = min_samples
+        self.z = z
+        self.prescreen = prescreen
+        self.fidelity = fidelity
+        self.cache = cache
+
+    @property
+    def params(self):
+        """
+        Parameters that determine the results of an analysis.
+        """
+        return {'noise' : self.noise, 'dims' : self.dims,
+                'frames' : self.frames, 'samples' : self.samples,
+                'ci_width' : self.ci_width, 'batch' : self.batch,
+                'min_samples' : self.min_samples, 'z' : self.z,
+                'prescreen' : self.prescreen, 'fidelity' : self.fidelity}
 
     #-------------------------------------------------------------------------#
 
     # Physics and movement
 
-    def simulate(self, tower):
+    def simulate(self, tower, scene = None, start = None):
         """
         Controls simulations and extracts positions
+
+        If a `scene` is given, it is restored to its snapshot rather than
+        rebuilding the world. If `start` is given, the blocks are moved to
+        those positions before simulating.
         """
-        tower_s = tower.serialize()
+        return self._trace(tower, scene = scene, start = start)['position']
+
+    def _trace(self, tower, scene = None, start = None):
         keys = list(tower.blocks.keys())[1:]
-        with tower_scene.TowerPhysics(tower_s) as scene:
-            trace = scene.get_trace(self.frames, keys)
-        return trace['position']
+        if scene is None:
+            with tower_scene.TowerPhysics(tower.serialize()) as scene:
+                if not start is None:
+                    scene.set_positions(keys, start)
+                return scene.get_trace(self.frames, keys,
+                                       fidelity = self.fidelity)
+        if start is None:
+            start = positions(tower)
+        return next(scene.get_traces([start], self.frames, keys,
+                                     fidelity = self.fidelity))
 
     def movement(self, positions, eps = 1E-3):
         vel = velocity(positions)
@@ -38,36 +89,192 @@ class TowerEntropy:
         """
         Generates `n` tower perturbations where each block in the tower
         is randomly shifted by a guassian with std = `noise`.
+
+        Returns:
+            An `(n, blocks, 3)` array of starting positions.
         """
-        return [shift(tower, self.noise) for _ in range(n)]
+        return perturbations(tower, self.noise, n, dims = self.dims)
 
-    # TODO clean up density and volume retrieval...
-    def kinetic_energy(self, tower):
+    @profiling.profile('TowerEntropy.kinetic_energy')
+    def kinetic_energy(self, tower, scene = None, start = None):
         """
         Computes the kinetic energy summed across each block
         for each time frame.
         """
-        positions = self.simulate(tower)
-        positions = positions[:self.frames]
-        # for each frame, for each object, 1 vel value
-        vel = velocity(positions).mean(axis = -1)
-        phys_params = tower.extract_feature('substance')
-        density  = np.array([d['density'] for d in phys_params])
-        volume = np.array([np.prod(tower.blocks[i+1]['block'].dimensions)
-                           for i in range(len(tower))])
-        mass = np.expand_dims(density * volume, axis = -1)
-        # sum the vel^2 for each object across frames
-        ke = 0.5 * np.dot(np.square(vel), mass).flatten()
-        return np.sum(ke)
+        if not self.cache is None:
+            key = self.cache.key('kinetic_energy', 'batch_energy',
+                                 tower.serialize(), start, self.params)
+            ke = self.cache.get(key)
+            if not ke is None:
+                return ke
+        trace = self._trace(tower, scene = scene, start = start)
+        ke = self.trace_energy(tower, trace['position'], trace['rotation'])
+        if not self.cache is None:
+            self.cache.put(key, ke)
+        return ke
+
+    def trace_energy(self, tower, positions, rotations, mass = None,
+                     moments = None):
+        """
+        Computes the kinetic energy of traces of `tower`: the translational
+        and rotational KE (see `batch_energy`) summed over frames and blocks.
+
+        Arguments:
+            tower (`Tower`) : The simulated tower.
+            positions (np.ndarray) : `(..., frames, blocks, 3)` positions.
+            rotations (np.ndarray) : `(..., frames, blocks, 4)` quaternions.
+            mass (np.ndarray, optional) : Block masses. Defaults to
+                `stability.masses`.
+            moments (np.ndarray, optional) : Moments of inertia. Defaults
+                to `inertia`.
+
+        Returns:
+            The KE of each trace, of shape `(...)`.
+        """
+        if mass is None:
+            mass = stability.masses(tower)
+        if moments is None:
+            moments = inertia(tower, mass = mass)
+        positions = np.asarray(positions)[..., :self.frames, :, :]
+        rotations = np.asarray(rotations)[..., :self.frames, :, :]
+        trans, rot = batch_energy(positions, rotations, mass, moments)
+        return np.sum(trans + rot, axis = (-2, -1))
+
+    @profiling.profile('TowerEntropy.kinetic_energies')
+    def kinetic_energies(self, tower):
+        """
+        Returns the KE of a tower under each random perturbation.
+
+        The number of perturbations is `samples` unless `ci_width` is set,
+        in which case sampling stops early once the confidence interval
+        of the mean is narrow enough.
+        """
+        if not self.cache is None:
+            key = self.cache.key('kinetic_energies', 'batch_energy',
+                                 tower.serialize(), np.random.get_state(),
+                                 self.params)
+            cached = self.cache.get(key)
+            if not cached is None:
+                kes, rng = cached
+                # leave the generator as if the perturbations were drawn
+                np.random.set_state(rng)
+                return kes
+        kes = self._kinetic_energies(tower)
+        if not self.cache is None:
+            self.cache.put(key, (kes, np.random.get_state()))
+        return kes
+
+    def _kinetic_energies(self, tower):
+        kes = []
+        keys = list(tower.blocks.keys())[1:]
+        mass = stability.masses(tower)
+        moments = inertia(tower, mass = mass)
+        with tower_scene.TowerPhysics(tower.serialize()) as scene:
+            scene.snapshot()
+            while len(kes) < self.samples:
+                if self.ci_width is None:
+                    n = self.samples
+                else:
+                    n = min(self.batch, self.samples - len(kes))
+                starts = self.perturb(tower, n = n)
+                batch = np.zeros(n)
+                if self.prescreen is None:
+                    unknown = np.ones(n, dtype = bool)
+                else:
+                    labels = stability.classify(tower, starts,
+                                                tol = self.prescreen)
+                    unknown = labels != stability.STABLE
+                traces = list(scene.get_traces(starts[unknown], self.frames,
+                                               keys, fidelity = self.fidelity))
+                if len(traces) > 0:
+                    batch[unknown] = self.trace_energy(
+                        tower, [t['position'] for t in traces],
+                        [t['rotation'] for t in traces],
+                        mass = mass, moments = moments)
+                kes.extend(batch)
+                if self.ci_width is None or len(kes) < self.min_samples:
+                    continue
+                if confidence_width(kes, self.z) <= self.ci_width:
+                    break
+        return np.array(kes)
+
+    def energies(self, tower, starts = None):
+        """
+        Simulates perturbations of a tower and returns the translational and
+        rotational KE of each block at each frame.
+
+        Arguments:
+            tower (`Tower`) : Tower to simulate.
+            starts (np.ndarray, optional) : `(n, blocks, 3)` starting
+                positions. Defaults to `samples` new perturbations.
+
+        Returns:
+            Two `(n, frames - 1, blocks)` arrays (see `batch_energy`).
+        """
+        if starts is None:
+            starts = self.perturb(tower, n = self.samples)
+        keys = list(tower.blocks.keys())[1:]
+        mass = stability.masses(tower)
+        with tower_scene.TowerPhysics(tower.serialize()) as scene:
+            traces = list(scene.get_traces(starts, self.frames, keys,
+                                           fidelity = self.fidelity))
+        pos = np.array([t['position'] for t in traces])
+        rot = np.array([t['rotation'] for t in traces])
+        return batch_energy(pos, rot, mass, inertia(tower, mass = mass))
 
     def analyze(self, tower):
         """
-        Returns statistics (mean, std) over the KE of a tower
+        Returns statistics (mean, std, samples) over the KE of a tower
         under random perturbations.
         """
-        perturbations = self.perturb(tower)
-        kes = [self.kinetic_energy(p) for p in perturbations]
-        return tuple((np.mean(kes), np.std(kes)))
+        kes = self.kinetic_energies(tower)
+        return tuple((np.mean(kes), np.std(kes), len(kes)))
+
+    def sweep(self, tower, deltas):
+        """
+        Computes the KE of alternates of a tower in one batch.
+
+        Each alternate is a `Generator.sweep` delta changing the substance of
+        one block. The world is loaded once and every alternate is evaluated
+        under the same `samples` perturbations.
+
+        Returns:
+            An `(len(deltas), samples)` array of KE.
+        """
+        keys = list(tower.blocks.keys())[1:]
+        index = {k : i for i, k in enumerate(keys)}
+        props = substances.tower_properties(tower)
+        mass = stability.masses(tower, props = props)
+        moments = inertia(tower, mass = mass)
+        friction = props['friction']
+        volume = np.array([np.prod(tower.blocks[k]['block'].dimensions)
+                           for k in keys])
+        starts = self.perturb(tower, n = self.samples)
+        kes = np.zeros((len(deltas), len(starts)))
+        with tower_scene.TowerPhysics(tower.serialize()) as scene:
+            scene.snapshot()
+            for i, delta in enumerate(deltas):
+                b = index[delta['block']]
+                d_mass = mass.copy()
+                d_mass[b] = delta['substance']['density'] * volume[b]
+                d_friction = friction.copy()
+                d_friction[b] = delta['substance']['friction']
+                if self.prescreen is None:
+                    unknown = np.ones(len(starts), dtype = bool)
+                else:
+                    labels = stability.classify(tower, starts, mass = d_mass,
+                                                tol = self.prescreen)
+                    unknown = labels != stability.STABLE
+                traces = list(scene.get_traces(starts[unknown], self.frames,
+                                               keys, masses = d_mass,
+                                               frictions = d_friction,
+                                               fidelity = self.fidelity))
+                if len(traces) > 0:
+                    kes[i, unknown] = self.trace_energy(
+                        tower, [t['position'] for t in traces],
+                        [t['rotation'] for t in traces], mass = d_mass,
+                        moments = moments * (d_mass / mass)[:, np.newaxis])
+        return kes
 
     #-------------------------------------------------------------------------#
 
@@ -75,9 +282,14 @@ class TowerEntropy:
         """
         Evaluates the stability of the tower at each block.
 
+        Arguments:
+          - tower (`Tower`) : The template tower.
+          - configurations (optional) : Deltas from `Generator.sweep`,
+            evaluated together with `sweep`. The output of
+            `Generator.configurations` is also accepted (see `as_deltas`).
+
         Returns:
-          - The randomly sampled congruent tower.
-          - The stability results for each block in the tower.
+          - The stability results for the template and each alternate.
         """
         d = [
             {'id' : 'template',
@@ -86,22 +298,131 @@ class TowerEntropy:
         ]
 
         if not configurations is None:
-            for (block_id, c_tower) in configurations:
+            configurations = as_deltas(tower, configurations)
+            kes = self.sweep(tower, configurations)
+            for delta, ke in zip(configurations, kes):
                 d.append(
                     {
-                        'id'      : '{0:d}'.format(block_id),
-                        'body'    : c_tower,
-                        'ke' : self.analyze(tower)
+                        'id'      : '{0:d}_{1!s}_{2!s}'.format(
+                            delta['block'], delta['appearance'],
+                            'con' if delta['congruent'] else 'inc'),
+                        'body'    : delta,
+                        'ke' : tuple((np.mean(ke), np.std(ke), len(ke)))
                     })
 
         return d
 
+def as_deltas(tower, configurations):
+    """
+    Converts the output of `Generator.configurations` to `Generator.sweep`
+    deltas. Lists of deltas are returned as they are.
+
+    `configurations` yields, for each block in order, a `dict` mapping each
+    appearance to a (congruent, incongruent) pair of towers.
+    """
+    configurations = list(configurations)
+    if all('block' in c for c in configurations):
+        return configurations
+    deltas = []
+    for block_id, alternates in zip(tower.ordered_blocks, configurations):
+        for mat, pair in alternates.items():
+            for congruent, alt in zip((True, False), pair):
+                block = alt.blocks[block_id]
+                deltas.append({'block' : int(block_id),
+                               'appearance' : block['appearance'],
+                               'congruent' : congruent,
+                               'substance' : block['substance']})
+    return deltas
+
+def confidence_width(values, z = 1.96):
+    """
+    Width of the normal confidence interval around the mean of `values`.
+    """
+    n = len(values)
+    if n < 2:
+        return np.inf
+    return 2.0 * z * np.std(values, ddof = 1) / np.sqrt(n)
+
 def velocity(positions):
     """
     Computes step-wise velocity.
     """
     return np.abs((positions[1:] - positions[:-1]) / len(positions))
 
+def inertia(tower, mass = None):
+    """
+    Returns the `(blocks, 3)` principal moments of inertia of the blocks in
+    a tower, treating each as a solid box as pybullet does.
+    """
+    keys = list(tower.blocks.keys())[1:]
+    dims = np.array([tower.blocks[k]['block'].dimensions for k in keys])
+    if mass is None:
+        mass = stability.masses(tower)
+    sq = np.square(dims)
+    return mass[:, np.newaxis] / 12.0 * (sq.sum(axis = 1)[:, np.newaxis] - sq)
+
+def batch_energy(positions, rotations, mass, inertia, fps = 60):
+    """
+    Computes the translational and rotational kinetic energy of traces.
+
+    Velocities are taken between consecutive frames. Angular velocities are
+    found in each block's frame from the relative rotation between frames.
+
+    Arguments:
+        positions (np.ndarray) : `(..., frames, blocks, 3)` positions.
+        rotations (np.ndarray) : `(..., frames, blocks, 4)` pybullet
+            `(x, y, z, w)` quaternions.
+        mass (np.ndarray) : `(blocks,)` masses.
+        inertia (np.ndarray) : `(blocks, 3)` principal moments of inertia.
+        fps (int, optional) : Frames per second of the traces.
+
+    Returns:
+        Two `(..., frames - 1, blocks)` arrays with the translational and
+        rotational KE.
+    """
+    vel = (positions[..., 1:, :, :] - positions[..., :-1, :, :]) * fps
+    trans = 0.5 * mass * np.sum(np.square(vel), axis = -1)
+
+    # relative rotation conj(q0) * q1, expressed in the frame of q0
+    q0 = rotations[..., :-1, :, :]
+    q1 = rotations[..., 1:, :, :]
+    v0, w0 = -q0[..., :3], q0[..., 3:]
+    v1, w1 = q1[..., :3], q1[..., 3:]
+    w = w0 * w1 - np.sum(v0 * v1, axis = -1, keepdims = True)
+    v = w0 * v1 + w1 * v0 + np.cross(v0, v1)
+    # shortest rotation
+    v = np.where(w < 0, -v, v)
+    w = np.abs(w)
+    sin = np.linalg.norm(v, axis = -1, keepdims = True)
+    angle = 2.0 * np.arctan2(sin, w)
+    scale = np.divide(angle, sin, out = np.full_like(sin, 2.0),
+                      where = sin > 1E-12)
+    omega = v * scale * fps
+    rot = 0.5 * np.sum(inertia * np.square(omega), axis = -1)
+    return trans, rot
+
+def positions(tower):
+    """
+    Returns the `(blocks, 3)` array of block positions in a tower.
+    """
+    keys = list(tower.blocks.keys())[1:]
+    return np.array([tower.blocks[k]['block'].pos for k in keys])
+
+def perturbations(tower, std, n, dims = [0, 1]):
+    """
+    Draws `n` perturbed copies of the block positions of a tower at once.
+
+    Each block is shifted along `dims` by a gaussian with std = `std`.
+
+    Returns:
+        An `(n, blocks, 3)` array of positions.
+    """
+    start = positions(tower)
+    starts = np.repeat(start[np.newaxis], n, axis = 0)
+    noise = np.random.normal(scale = std, size = (n, len(start), len(dims)))
+    starts[:, :, dims] += noise
+    return starts
+
 def shift(tower, std):
     """
     Applies an xy shift to blocks in a tower.
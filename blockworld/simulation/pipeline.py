@@ -0,0 +1,264 @@
+"""
+Generates, simulates, analyzes and renders towers as one stream of tasks.
+
+Each tower moves through the stages independently, so stages of different
+towers overlap and all workers stay busy. The number of towers in flight
+is bounded, and each tower's results are written to its own directory as
+soon as they are ready.
+
+Any executor with a `submit` method returning futures can be used, such as
+a `concurrent.futures.ProcessPoolExecutor` or a `dask.distributed.Client`.
+
+Example:
+
+    from dask import distributed
+    client = distributed.Client(distributed.LocalCluster())
+    pipe = Pipeline('out', {'Wood' : 1.0}, k = 5)
+    for summary in pipe.run(100, executor = client):
+        print(summary)
+"""
+
+import os
+import copy
+import json
+import concurrent.futures
+
+import numpy as np
+
+from blockworld import towers
+from blockworld.utils import json_encoders
+from blockworld.simulation import physics, traces, tower_scene
+from blockworld.simulation.generator import Generator
+from blockworld.simulation.render_scheduler import RenderScheduler
+
+#-----------------------------------------------------------------------------#
+# Stages
+
+def generate(materials, base, k, seed):
+    """
+    Returns a serialized random tower of `k` blocks on `base`.
+    """
+    np.random.seed(seed)
+    gen = Generator(materials, 'local')
+    tower, _ = next(gen(base, k = k, n = 1))
+    return tower.serialize()
+
+def simulate(tower_s, frames, fidelity = 'standard'):
+    """
+    Returns the `traces.Trace` of an unperturbed tower.
+    """
+    # `load` consumes its argument
+    tower = towers.simple_tower.load(copy.deepcopy(tower_s))
+    with tower_scene.TowerPhysics(tower_s) as scene:
+        trace = scene.get_trace(frames, tower.ordered_blocks,
+                                fidelity = fidelity)
+    return traces.Trace(trace)
+
+def analyze(tower_s, params, seed, alternates = False):
+    """
+    Returns the `TowerEntropy` results of a tower, without tower bodies.
+    """
+    np.random.seed(seed)
+    # `load` consumes its argument
+    tower = towers.simple_tower.load(copy.deepcopy(tower_s))
+    configurations = None
+    if alternates:
+        configurations = Generator({'Wood' : 1.0}, 'local').sweep(tower)
+    results = physics.TowerEntropy(**params)(tower,
+                                             configurations = configurations)
+    for r in results:
+        if r['id'] == 'template':
+            del r['body']
+    return results
+
+def render(scene, trace, out, n_frames, **kwargs):
+    """
+    Renders a tower with one `render.py` process.
+
+    Returns:
+        The frames that could not be rendered (see `RenderScheduler`).
+    """
+    scheduler = RenderScheduler(scene, trace, out, n_frames, workers = 1,
+                                **kwargs)
+    scheduler.run()
+    return scheduler.failed
+
+#-----------------------------------------------------------------------------#
+
+class Pipeline:
+
+    """
+    Streams towers through generation, simulation, analysis and rendering.
+
+    Results for the i-th tower are written to `out/tower_<i>`:
+
+      - tower.json: the serialized tower
+      - scene.json and trace/: the trace, as read by `render.py`
+      - ke.json: `TowerEntropy` results
+      - render/: frames, if `render` is set
+      - result.json: a summary, written last
+
+    Towers with a `result.json` are skipped, so an interrupted run resumes.
+
+    Attributes:
+
+      - out (str): Output directory.
+      - materials (dict): Material distribution for `Generator`.
+      - base (tuple or `Tower`): Base to build on.
+      - k (int): Number of blocks per tower.
+      - frames (int): Frames of the unperturbed trace.
+      - fidelity (str): One of `tower_scene.presets`.
+      - entropy (dict): Keyword arguments for `TowerEntropy`.
+      - alternates (bool): Also analyze the `Generator.sweep` alternates.
+      - render (dict, optional): If given, towers are rendered with these
+        keyword arguments for `RenderScheduler`.
+      - max_in_flight (int, optional): Maximum number of towers in progress.
+        Defaults to twice the number of workers.
+      - seed (int): Seed of the first tower; tower `i` uses `seed + i`.
+    """
+
+    def __init__(self, out, materials, base = (2, 1), k = 5, frames = 120,
+                 fidelity = 'standard', entropy = None, alternates = False,
+                 render = None, max_in_flight = None, seed = 0):
+        self.out = out
+        self.materials = materials
+        self.base = base
+        self.k = k
+        self.frames = frames
+        self.fidelity = fidelity
+        self.entropy = {} if entropy is None else dict(entropy)
+        self.alternates = alternates
+        self.render = render
+        self.max_in_flight = max_in_flight
+        self.seed = seed
+
+    # Methods #
+
+    def path(self, i, *parts):
+        return os.path.join(self.out, 'tower_{0:d}'.format(i), *parts)
+
+    def finished(self, i):
+        return os.path.isfile(self.path(i, 'result.json'))
+
+    def run(self, n, executor = None):
+        """
+        Processes towers `0 .. n - 1`.
+
+        Arguments:
+            n (int): Number of towers.
+            executor (optional): Executor to submit tasks to. Defaults to a
+                `ProcessPoolExecutor` over all cores.
+
+        Returns:
+            A generator over the summary of each tower, in order of
+            completion.
+        """
+        if executor is None:
+            with concurrent.futures.ProcessPoolExecutor() as executor:
+                yield from self.run(n, executor = executor)
+            return
+
+        limit = self.max_in_flight
+        if limit is None:
+            limit = 2 * _workers(executor)
+        todo = [i for i in range(n) if not self.finished(i)]
+        todo.reverse()
+        # future -> (tower index, stage)
+        running = {}
+        # tower index -> results of finished stages
+        state = {}
+
+        while len(todo) > 0 or len(running) > 0:
+            while len(todo) > 0 and len(state) < limit:
+                i = todo.pop()
+                state[i] = {}
+                f = executor.submit(generate, self.materials, self.base,
+                                    self.k, self.seed + i)
+                running[f] = (i, 'generate')
+
+            done = _wait(list(running.keys()))
+            for f in done:
+                i, stage = running.pop(f)
+                state[i][stage] = f.result()
+                for g, s in self._advance(executor, i, stage, state[i]):
+                    running[g] = (i, s)
+                if self._complete(state[i]):
+                    yield self._finish(i, state.pop(i))
+
+    def _advance(self, executor, i, stage, results):
+        """
+        Writes the results of a finished stage and submits the stages that
+        depend on it.
+        """
+        if stage == 'generate':
+            tower_s = results['generate']
+            os.makedirs(self.path(i), exist_ok = True)
+            _write_json(self.path(i, 'tower.json'), tower_s)
+            return [(executor.submit(simulate, tower_s, self.frames,
+                                     fidelity = self.fidelity), 'simulate'),
+                    (executor.submit(analyze, tower_s, self.entropy,
+                                     self.seed + i,
+                                     alternates = self.alternates),
+                     'analyze')]
+        if stage == 'simulate':
+            scene, trace = self._write_trace(i, results)
+            if not self.render is None:
+                return [(executor.submit(render, scene, trace,
+                                         self.path(i), self.frames,
+                                         **self.render), 'render')]
+        elif stage == 'analyze':
+            _write_json(self.path(i, 'ke.json'), results['analyze'])
+        return []
+
+    def _complete(self, results):
+        stages = ['generate', 'simulate', 'analyze']
+        if not self.render is None:
+            stages.append('render')
+        return all(s in results for s in stages)
+
+    def _write_trace(self, i, results):
+        scene = self.path(i, 'scene.json')
+        _write_json(scene, results['generate'])
+        trace = self.path(i, 'trace')
+        os.makedirs(trace, exist_ok = True)
+        for field in results['simulate'].fields:
+            np.save(os.path.join(trace, field + '.npy'),
+                    results['simulate'][field])
+        return scene, trace
+
+    def _finish(self, i, results):
+        template = results['analyze'][0]
+        summary = {'tower' : i, 'path' : self.path(i),
+                   'ke' : template['ke']}
+        if 'render' in results:
+            summary['failed'] = results['render']
+        _write_json(self.path(i, 'result.json'), summary)
+        return summary
+
+
+def _write_json(path, obj):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(obj, f, cls = json_encoders.TowerEncoder)
+    os.replace(tmp, path)
+
+def _workers(executor):
+    """
+    Number of concurrent tasks an executor runs.
+    """
+    if hasattr(executor, '_max_workers'):
+        return executor._max_workers
+    if hasattr(executor, 'nthreads'):
+        # `dask.distributed.Client`
+        return max(1, sum(executor.nthreads().values()))
+    return os.cpu_count()
+
+def _wait(futures):
+    """
+    Waits for at least one future to finish and returns those that have.
+    """
+    if type(futures[0]).__module__.startswith('distributed'):
+        from dask import distributed
+        return distributed.wait(futures, return_when = 'FIRST_COMPLETED').done
+    return concurrent.futures.wait(
+        futures, return_when = concurrent.futures.FIRST_COMPLETED).done
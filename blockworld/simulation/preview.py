@@ -0,0 +1,222 @@
+"""
+Lightweight in-process previews of towers and physics traces.
+
+Blocks are drawn as orthographic projections of their (possibly rotated)
+boxes with a painter's algorithm, entirely in NumPy. Intended for quick
+inspection of large datasets; see `render.py` for final renders.
+"""
+
+import os
+import json
+
+import numpy as np
+
+from blockworld.utils import math_2d
+
+# RGB colors for block appearances
+colors = {
+    'Wood' : (0.76, 0.60, 0.42),
+    'Metal' : (0.60, 0.62, 0.66),
+    'H' : (0.80, 0.25, 0.20),
+    'L' : (0.25, 0.45, 0.80),
+}
+default_color = (0.55, 0.55, 0.55)
+ground_color = (0.35, 0.35, 0.35)
+
+# (horizontal, vertical, depth) axes and depth sign for each view
+views = {
+    'front' : (0, 2, 1, 1.0),
+    'side' : (1, 2, 0, -1.0),
+}
+
+def quaternion_matrix(q):
+    """
+    Rotation matrix of a pybullet `(x, y, z, w)` quaternion.
+    """
+    x, y, z, w = q
+    return np.array([
+        [1 - 2*(y*y + z*z), 2*(x*y - z*w), 2*(x*z + y*w)],
+        [2*(x*y + z*w), 1 - 2*(x*x + z*z), 2*(y*z - x*w)],
+        [2*(x*z - y*w), 2*(y*z + x*w), 1 - 2*(x*x + y*y)]])
+
+# corners of the unit cube centered at the origin
+_corners = np.array(np.meshgrid([-0.5, 0.5], [-0.5, 0.5],
+                                [-0.5, 0.5])).T.reshape(-1, 3)
+
+class Preview:
+
+    """
+    Rasterizes towers and traces into RGB images.
+
+    Attributes:
+
+      - resolution (tuple(int)): Image (width, height) in pixels.
+      - view (str): One of `views`.
+      - extent (tuple(float), optional): World (left, right, bottom, top)
+        shown in the image. Fitted to each scene if `None`.
+      - background (tuple(float)): RGB background color.
+    """
+
+    def __init__(self, resolution = (128, 128), view = 'front',
+                 extent = None, background = (1.0, 1.0, 1.0)):
+        if not view in views:
+            raise ValueError('Unknown view {}'.format(view))
+        self.resolution = tuple(resolution)
+        self.view = view
+        self.extent = extent
+        self.background = np.array(background, dtype = np.float32)
+
+    def fit(self, scene, padding = 1.0):
+        """
+        Returns a square extent containing the blocks of a serialized scene
+        (or a path to its json).
+
+        Set it as `extent` to keep the view fixed over the frames of a trace.
+        """
+        h, v, _, _ = views[self.view]
+        blocks = _blocks(scene)
+        pos = np.array([b['data']['pos'] for b in blocks])
+        dims = np.array([b['data']['dims'] for b in blocks])
+        lo = np.min(pos - dims / 2.0, axis = 0)
+        hi = np.max(pos + dims / 2.0, axis = 0)
+        size = max(hi[h] - lo[h], hi[v]) + 2 * padding
+        center = (hi[h] + lo[h]) / 2.0
+        return (center - size / 2.0, center + size / 2.0,
+                -padding, size - padding)
+
+    def frame(self, scene, trace = None, frame = 0):
+        """
+        Rasterizes one frame.
+
+        Arguments:
+            scene (list or str): Serialized tower (see `SimpleTower.serialize`)
+                or a path to its json.
+            trace (dict, optional): Result of `TowerPhysics.get_trace` (or a
+                `traces.Trace`) for the blocks of `scene` in order.
+            frame (int, optional): Frame of `trace` to draw.
+
+        Returns:
+            A `(height, width, 3)` float32 image.
+        """
+        blocks = _blocks(scene)
+        extent = self.extent
+        if extent is None:
+            extent = self.fit(blocks)
+        width, height = self.resolution
+        image = np.empty((height, width, 3), dtype = np.float32)
+        image[:] = self.background
+
+        h, v, d, sign = views[self.view]
+        left, right, bottom, top = extent
+        scale = np.array([width / (right - left), height / (top - bottom)])
+
+        # ground plane
+        ground = int(round(height - (0 - bottom) * scale[1]))
+        if ground < height:
+            image[max(ground, 0):] = ground_color
+
+        boxes = []
+        for i, b in enumerate(blocks):
+            dims = np.array(b['data']['dims'])
+            if trace is None:
+                pos = np.array(b['data']['pos'])
+                rot = np.eye(3)
+            else:
+                pos = np.asarray(trace['position'][frame][i])
+                rot = quaternion_matrix(trace['rotation'][frame][i])
+            corners = (_corners * dims).dot(rot.T) + pos
+            color = colors.get(b['data'].get('appearance'), default_color)
+            boxes.append((sign * pos[d], corners, color))
+
+        # painter's algorithm: far to near
+        for _, corners, color in sorted(boxes, key = lambda x: -x[0]):
+            uv = np.empty((len(corners), 2))
+            uv[:, 0] = (corners[:, h] - left) * scale[0]
+            uv[:, 1] = height - (corners[:, v] - bottom) * scale[1]
+            _fill(image, uv, np.array(color, dtype = np.float32))
+        return image
+
+    def frames(self, scene, trace, frames = None):
+        """
+        Generator over rasterized frames of a trace.
+        """
+        blocks = _blocks(scene)
+        if frames is None:
+            frames = range(len(trace['position']))
+        for f in frames:
+            yield self.frame(blocks, trace, frame = f)
+
+    def save(self, out, scene, trace = None, frames = None):
+        """
+        Writes frames as `out/<i>.png`, as `render.py` does.
+        """
+        if not os.path.isdir(out):
+            os.makedirs(out)
+        if trace is None:
+            images = [self.frame(scene)]
+        else:
+            images = self.frames(scene, trace, frames = frames)
+        for i, image in enumerate(images):
+            save_png(os.path.join(out, '{0:d}.png'.format(i)), image)
+
+
+def _blocks(scene):
+    """
+    Returns the non-base blocks of a serialized scene.
+    """
+    if isinstance(scene, str):
+        with open(scene, 'r') as f:
+            scene = json.load(f)
+    return [b for b in scene if b['id'] != 0]
+
+def _fill(image, uv, color, edge = 0.75):
+    """
+    Fills the convex hull of the pixel coordinates `uv` with `color`,
+    darkening pixels within `edge` pixels of its boundary.
+    """
+    height, width, _ = image.shape
+    hull = np.array(math_2d.convex_hull_graham(np.round(uv, 6)))
+    if len(hull) < 3:
+        return
+    x0, y0 = np.maximum(np.floor(hull.min(axis = 0)).astype(int), 0)
+    x1 = min(int(np.ceil(hull[:, 0].max())), width)
+    y1 = min(int(np.ceil(hull[:, 1].max())), height)
+    if x0 >= x1 or y0 >= y1:
+        return
+    xs, ys = np.meshgrid(np.arange(x0, x1) + 0.5, np.arange(y0, y1) + 0.5)
+    edges = np.roll(hull, -1, axis = 0) - hull
+    lengths = np.linalg.norm(edges, axis = 1)
+    # signed distance to each edge of the counter-clockwise hull
+    dist = (edges[:, 0, None, None] * (ys - hull[:, 1, None, None]) -
+            edges[:, 1, None, None] * (xs - hull[:, 0, None, None]))
+    dist = dist / lengths[:, None, None]
+    inside = dist.min(axis = 0)
+    region = image[y0:y1, x0:x1]
+    region[inside >= 0] = color
+    region[(inside >= 0) & (inside < edge)] = color * 0.5
+
+def contact_sheet(images, cols = 8, pad = 2, background = 1.0):
+    """
+    Tiles equally sized images into one image.
+    """
+    images = list(images)
+    if len(images) == 0:
+        raise ValueError('No images given')
+    height, width, c = images[0].shape
+    rows = int(np.ceil(len(images) / cols))
+    sheet = np.full((rows * (height + pad) + pad,
+                     cols * (width + pad) + pad, c), background,
+                    dtype = np.float32)
+    for i, image in enumerate(images):
+        r, col = divmod(i, cols)
+        y = pad + r * (height + pad)
+        x = pad + col * (width + pad)
+        sheet[y:y + height, x:x + width] = image
+    return sheet
+
+def save_png(path, image):
+    """
+    Writes a float RGB image to a PNG file.
+    """
+    from matplotlib import image as mpimg
+    mpimg.imsave(path, np.clip(image, 0.0, 1.0))
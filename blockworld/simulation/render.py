@@ -1,12 +1,17 @@
 import os
 import sys
 import bpy
+import glob
 import json
+import time
 import argparse
 import mathutils
+import traceback
 
 import numpy as np
 materials_path = os.path.dirname(os.path.realpath(__file__)) + '/materials.blend'
+# Duration (seconds) of the camera ring rendered in `frozen` mode
+circle_dur = 2
 #################################################
 # https://stackoverflow.com/questions/28075599/opening-blend-files-using-blenders-python-api
 from bpy.app.handlers import persistent
@@ -25,24 +30,32 @@ class BlockScene:
     frames : The total number of frames to render
     (optional) warmup : (default 6) The number of frames to bake prior to
         rendering. Sets the total number of bakes frames to `frames` + `warmup`
+    (optional) load_materials : (default True) Whether to reopen the
+        materials file. If False, only the blocks of a previous scene are
+        removed and the loaded materials are reused.
     '''
 
-    def __init__(self, scene_json, trace = None, wire_frame = False):
+    def __init__(self, scene_json, trace = None, wire_frame = False,
+                 load_materials = True):
 
         # Initialize attributes
         self.wire_frame = wire_frame
         self.trace = trace
+        self.baked = False
 
-        # Clear scene
-        bpy.ops.object.mode_set(mode='OBJECT')
-        bpy.ops.object.select_by_type(type='MESH')
-        bpy.ops.object.delete(use_global=False)
-        for item in bpy.data.meshes:
-            bpy.data.meshes.remove(item)
-
-        # Load materials and textures
-        with Suppressor():
-            bpy.ops.wm.open_mainfile(filepath=materials_path)
+        if load_materials:
+            # Clear scene
+            bpy.ops.object.mode_set(mode='OBJECT')
+            bpy.ops.object.select_by_type(type='MESH')
+            bpy.ops.object.delete(use_global=False)
+            for item in bpy.data.meshes:
+                bpy.data.meshes.remove(item)
+
+            # Load materials and textures
+            with Suppressor():
+                bpy.ops.wm.open_mainfile(filepath=materials_path)
+        else:
+            self.clear_blocks()
 
         if not trace is None:
             frames = len(trace['position'])
@@ -56,6 +69,23 @@ class BlockScene:
         self.load_scene(scene_json)
 
 
+    def clear_blocks(self):
+        """
+        Removes the blocks and base created by `load_scene`, keeping the
+        rest of the world and its materials.
+        """
+        for obj in list(bpy.data.objects):
+            if obj.name != 'base' and not obj.name.isdigit():
+                continue
+            mesh = obj.data
+            bpy.data.objects.remove(obj, do_unlink = True)
+            if not mesh is None and mesh.users == 0:
+                bpy.data.meshes.remove(mesh)
+        for action in list(bpy.data.actions):
+            if action.users == 0:
+                bpy.data.actions.remove(action)
+        bpy.context.scene.update()
+
     def select_obj(self, obj):
         """
         Brings the given object into active context.
@@ -210,28 +240,59 @@ class BlockScene:
         rot_quat = direction.to_track_quat('-Z', 'Y')
         self.rotate_obj(camera, rot_quat)
 
-    def frame_set(self, frame):
-        bpy.context.scene.frame_set(frame)
+    def bake_trace(self):
+        """
+        Writes the location and rotation keyframes of every block for the
+        whole trace at once.
 
-        positions = np.array(self.trace['position'][frame])
-        rotations = np.array(self.trace['rotation'][frame])
-        n_blocks = positions.shape[0]
+        Keyframe `i` holds frame `i` of the trace. Curves are filled directly
+        rather than through `keyframe_insert`, so the scene is only updated
+        once.
+        """
+        positions = np.array(self.trace['position'])
+        # blender quaternions are (w, x, y, z)
+        rotations = np.roll(np.array(self.trace['rotation']), 1, axis = -1)
+        n_frames, n_blocks = positions.shape[:2]
+        keys = np.arange(n_frames, dtype = float)
         for block_i in range(n_blocks):
             block = bpy.data.objects['{}'.format(block_i + 1)]
-            self.move_obj(block, positions[block_i])
-            self.rotate_obj(block, rotations[block_i])
-            block.keyframe_insert(data_path='location', index = -1)
-            block.keyframe_insert(data_path='rotation_quaternion', index = -1)
-
+            block.rotation_mode = 'QUATERNION'
+            if block.animation_data is None:
+                block.animation_data_create()
+            action = bpy.data.actions.new('{}_Action'.format(block.name))
+            block.animation_data.action = action
+            curves = [('location', positions[:, block_i]),
+                      ('rotation_quaternion', rotations[:, block_i])]
+            for data_path, values in curves:
+                for index in range(values.shape[1]):
+                    fc = action.fcurves.new(data_path, index = index)
+                    fc.keyframe_points.add(n_frames)
+                    co = np.column_stack((keys, values[:, index]))
+                    fc.keyframe_points.foreach_set('co', co.ravel())
+                    fc.update()
+            block.location = positions[0, block_i]
+            block.rotation_quaternion = rotations[0, block_i]
+
+        self.baked = True
         bpy.context.scene.update()
 
+    def frame_set(self, frame):
+        """
+        Moves the scene to the given frame of the trace, baking the trace
+        on first use.
+        """
+        if not self.baked:
+            self.bake_trace()
+        bpy.context.scene.frame_set(frame)
+
 
     def render(self, output_name, frames, show = [],
-               resolution = (256, 256), camera_rot = None):
+               resolution = (256, 256), camera_rot = None, indices = None):
         """
         output_name: Path to save frames
         frames: a list of frames to render (shifted by warmup)
         show: a list of object names to render
+        indices: if given, only these positions in `frames` are rendered
         """
         if not os.path.isdir(output_name):
             os.mkdir(output_name)
@@ -247,6 +308,8 @@ class BlockScene:
         if camera_rot is None:
             camera_rot = np.zeros(len(frames))
         for i, (frame, cam) in enumerate(zip(frames, camera_rot)):
+            if not indices is None and not i in indices:
+                continue
             out = os.path.join(output_name, '{0:d}'.format(i))
             if os.path.isfile(out + '.png'):
                 print('Frame {} already rendered'.format(frame))
@@ -258,7 +321,7 @@ class BlockScene:
 
 
     def render_circle(self, out_path, freeze = True, dur = 1,
-                      resolution = (256, 256)):
+                      resolution = (256, 256), indices = None):
         """
         Renders a ring around a tower.
         Arguments:
@@ -266,6 +329,7 @@ class BlockScene:
             freeze (bool): Whether or not to run physics.
             dur (float, optional): Duration in seconds.
             resolution (float, optional): Resolution of render.
+            indices (list, optional): Only render these frames of the ring.
         """
         self.set_rendering_params(resolution)
         n = int(dur * bpy.context.scene.render.fps)
@@ -276,7 +340,7 @@ class BlockScene:
             frames = np.arange(n)
 
         self.render(out_path, frames, resolution = resolution,
-                    camera_rot = rots)
+                    camera_rot = rots, indices = indices)
 
     def save(self, out):
         """
@@ -313,13 +377,49 @@ class Suppressor(object):
         for fd in self.null_fds + self.save_fds:
             os.close(fd)
 
+def load_scene(scene):
+    """
+    Returns the scene described by a json string or a path to a json file.
+    """
+    if not isinstance(scene, str):
+        return scene
+    if os.path.isfile(scene):
+        with open(scene, 'r') as f:
+            return json.load(f)
+    return json.loads(scene)
+
+def load_trace(trace, mmap = False):
+    """
+    Returns the trace described by a json string or path.
+
+    Paths may point to a json file, an `.npz` archive or a directory of
+    `<field>.npy` files. The latter are memory-mapped if `mmap` is set.
+    """
+    if not isinstance(trace, str):
+        return trace
+    if os.path.isdir(trace):
+        mode = 'r' if mmap else None
+        return {os.path.splitext(os.path.basename(f))[0] :
+                np.load(f, mmap_mode = mode)
+                for f in glob.glob(os.path.join(trace, '*.npy'))}
+    if trace.endswith('.npz'):
+        with np.load(trace) as d:
+            return {k : d[k] for k in d.files}
+    if os.path.isfile(trace):
+        with open(trace, 'r') as f:
+            return json.load(f)
+    return json.loads(trace)
+
 def parser(args):
 
     p = argparse.ArgumentParser(description = 'Renders blockworld scene')
-    p.add_argument('--scene', type = json.loads,
-                   help = 'Tower json describing the scene.')
-    p.add_argument('--trace', type = json.loads,
-                   help = 'Trace json for physics.')
+    p.add_argument('--scene', type = str,
+                   help = 'Tower json describing the scene, or its path.')
+    p.add_argument('--trace', type = str,
+                   help = 'Trace json for physics, or the path to a ' +\
+                   'json file, an `.npz` file or a directory of `.npy` files.')
+    p.add_argument('--mmap', action = 'store_true',
+                   help = 'Memory-map `.npy` trace files')
     p.add_argument('--out', type = str,
                    help = 'Path to save rendering')
     p.add_argument('--wireframe', action = 'store_true',
@@ -331,17 +431,24 @@ def parser(args):
                    help = 'mode to render')
     p.add_argument('--resolution', type = int, nargs = 2,
                    default = (256,256),  help = 'Render resolution')
+    p.add_argument('--indices', type = int, nargs = '+',
+                   help = 'Only render these output frames')
+    p.add_argument('--worker', type = str,
+                   help = 'Spool directory to process jobs from. ' +\
+                   'See `worker`.')
+    p.add_argument('--poll', type = float, default = 0.5,
+                   help = 'Seconds between checks of an empty spool')
     return p.parse_args(args)
 
 
-def main():
-    argv = sys.argv
-    print(argv[:6])
-    if '--' in sys.argv:
-        argv = sys.argv[sys.argv.index('--') + 1:]
-    args = parser(argv)
-
-    scene = BlockScene(args.scene, args.trace, wire_frame = args.wireframe)
+def run(args, load_materials = True):
+    """
+    Processes one scene as described by the parsed arguments.
+    """
+    args.scene = load_scene(args.scene)
+    args.trace = load_trace(args.trace, mmap = args.mmap)
+    scene = BlockScene(args.scene, args.trace, wire_frame = args.wireframe,
+                       load_materials = load_materials)
 
     path = os.path.join(args.out, 'render')
     if not os.path.isdir(path):
@@ -350,19 +457,79 @@ def main():
     frozen_path = os.path.join(path, 'frozen')
     motion_path = os.path.join(path, 'motion')
     n_frames = len(args.trace['position'])
+    indices = None if args.indices is None else set(args.indices)
     if args.render_mode == 'default' or args.render_mode == 'frozen':
-        scene.render_circle(frozen_path, freeze = True, dur = 2,
-                            resolution = args.resolution)
+        scene.render_circle(frozen_path, freeze = True, dur = circle_dur,
+                            resolution = args.resolution, indices = indices)
     if args.render_mode == 'default' or args.render_mode == 'motion':
         scene.render(motion_path, np.arange(n_frames),
-                     resolution = args.resolution)
+                     resolution = args.resolution, indices = indices)
     if args.render_mode == 'none':
-        for frame in range(n_frames):
-            scene.frame_set(frame)
+        scene.bake_trace()
 
     if args.save_world:
         path = os.path.join(args.out, 'world.blend')
         scene.save(path)
 
+
+def worker(spool, poll = 0.5):
+    """
+    Processes render jobs from a spool directory until told to stop.
+
+    Each job is a `<name>.json` file holding a `dict` with any of the
+    command line options (`scene`, `trace`, `out`, `render_mode`, ...).
+    `scene` and `trace` may be given inline or as paths (see `load_trace`).
+    Jobs are claimed by renaming them to `<name>.running`, and marked as
+    `<name>.done` or `<name>.failed` (with the error in `<name>.log`) once
+    processed, so that several workers can share a spool.
+
+    The worker exits once the spool is empty and a file named `STOP` exists.
+
+    Materials are only loaded for the first job; later jobs only replace the
+    blocks.
+    """
+    loaded = False
+    while True:
+        jobs = sorted(glob.glob(os.path.join(spool, '*.json')))
+        if len(jobs) == 0:
+            if os.path.isfile(os.path.join(spool, 'STOP')):
+                break
+            time.sleep(poll)
+            continue
+        for job in jobs:
+            name = os.path.splitext(job)[0]
+            try:
+                os.rename(job, name + '.running')
+            except OSError:
+                # claimed by another worker
+                continue
+            with open(name + '.running', 'r') as f:
+                job_d = json.load(f)
+            args = parser([])
+            vars(args).update(job_d)
+            try:
+                run(args, load_materials = not loaded)
+                loaded = True
+                os.rename(name + '.running', name + '.done')
+            except Exception:
+                with open(name + '.log', 'w') as f:
+                    f.write(traceback.format_exc())
+                os.rename(name + '.running', name + '.failed')
+                # start from a fresh world on the next job
+                loaded = False
+
+
+def main():
+    argv = sys.argv
+    print(argv[:6])
+    if '--' in sys.argv:
+        argv = sys.argv[sys.argv.index('--') + 1:]
+    args = parser(argv)
+
+    if not args.worker is None:
+        worker(args.worker, poll = args.poll)
+    else:
+        run(args)
+
 if __name__ == '__main__':
     main()
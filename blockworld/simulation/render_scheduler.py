@@ -0,0 +1,196 @@
+"""
+Splits the frames of a render across several Blender processes.
+
+Progress is kept in a manifest next to the rendered frames so that an
+interrupted render resumes with the missing frames only.
+"""
+
+import os
+import json
+import time
+import shlex
+import subprocess
+
+import numpy as np
+
+render_path = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                           'render.py')
+blender = 'blender --background -P {0!s} --'.format(render_path)
+
+# Frames of the camera ring in `frozen` mode (`render.circle_dur` seconds at
+# 60 fps)
+circle_frames = 120
+
+def complete(path):
+    """
+    Returns `True` if `path` is a fully written PNG.
+    """
+    try:
+        with open(path, 'rb') as f:
+            f.seek(-12, os.SEEK_END)
+            return b'IEND' in f.read()
+    except OSError:
+        return False
+
+class RenderScheduler:
+
+    """
+    Renders the frames of one tower with several `render.py` processes.
+
+    Each mode's frames are split into shards of at most `shard` frames which
+    are rendered by up to `workers` concurrent processes. Frames missing
+    after a process exits are retried up to `retries` times.
+
+    Attributes:
+
+      - scene (str): Path to the scene json.
+      - trace (str): Path to the trace (see `render.load_trace`).
+      - out (str): Output directory, as for `render.py --out`.
+      - n_frames (int): Number of frames in the trace.
+      - modes ([str]): Subset of 'frozen' and 'motion'.
+      - workers (int): Maximum number of concurrent processes.
+      - shard (int, optional): Maximum number of frames per process.
+      - retries (int): Attempts per frame after the first.
+      - cmd (str): Command prefix used to launch `render.py`.
+      - options ([str]): Further `render.py` arguments.
+    """
+
+    def __init__(self, scene, trace, out, n_frames,
+                 modes = ('frozen', 'motion'), workers = 4, shard = None,
+                 retries = 2, cmd = blender, options = ()):
+        self.scene = scene
+        self.trace = trace
+        self.out = out
+        self.n_frames = n_frames
+        self.modes = list(modes)
+        self.workers = workers
+        self.shard = shard
+        self.retries = retries
+        self.cmd = cmd
+        self.options = list(options)
+        self.failed = {}
+
+    # Properties #
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.out, 'render', 'manifest.json')
+
+    # Methods #
+
+    def frames(self, mode):
+        """
+        Returns the output frame indices of a mode.
+        """
+        if mode == 'frozen':
+            return list(range(circle_frames))
+        elif mode == 'motion':
+            return list(range(self.n_frames))
+        raise ValueError('Unknown mode {}'.format(mode))
+
+    def frame_path(self, mode, i):
+        return os.path.join(self.out, 'render', mode, '{0:d}.png'.format(i))
+
+    def load_manifest(self):
+        if os.path.isfile(self.manifest_path):
+            with open(self.manifest_path, 'r') as f:
+                return json.load(f)
+        return {m : {'done' : [], 'attempts' : {}} for m in self.modes}
+
+    def save_manifest(self, manifest):
+        tmp = self.manifest_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp, self.manifest_path)
+
+    def shards(self, pending):
+        """
+        Splits pending frames of each mode into per-process jobs.
+        """
+        jobs = []
+        for mode, frames in pending.items():
+            if len(frames) == 0:
+                continue
+            n = self.shard
+            if n is None:
+                n = int(np.ceil(len(frames) / self.workers))
+            for i in range(0, len(frames), n):
+                jobs.append((mode, frames[i:i + n]))
+        return jobs
+
+    def command(self, mode, indices):
+        cmd = shlex.split(self.cmd)
+        cmd += ['--scene', self.scene, '--trace', self.trace,
+                '--out', self.out, '--render_mode', mode, '--indices']
+        cmd += [str(i) for i in indices]
+        return cmd + self.options
+
+    def run(self, poll = 0.5):
+        """
+        Renders all missing frames.
+
+        Returns:
+            A `dict` mapping each mode to its frame paths in order.
+            Frames that failed after all retries are listed in `failed`.
+        """
+        for mode in self.modes:
+            d = os.path.join(self.out, 'render', mode)
+            if not os.path.isdir(d):
+                os.makedirs(d)
+        manifest = self.load_manifest()
+        for mode in self.modes:
+            manifest.setdefault(mode, {'done' : [], 'attempts' : {}})
+
+        while True:
+            pending = {}
+            for mode in self.modes:
+                done = set(manifest[mode]['done'])
+                attempts = manifest[mode]['attempts']
+                pending[mode] = [i for i in self.frames(mode)
+                                 if not i in done and
+                                 attempts.get(str(i), 0) <= self.retries]
+            jobs = self.shards(pending)
+            if len(jobs) == 0:
+                break
+            self._execute(jobs, manifest, poll)
+
+        self.failed = {m : sorted(int(i) for i, a in
+                                  manifest[m]['attempts'].items()
+                                  if a > self.retries and
+                                  not int(i) in manifest[m]['done'])
+                       for m in self.modes}
+        return {m : [self.frame_path(m, i) for i in self.frames(m)]
+                for m in self.modes}
+
+    def _execute(self, jobs, manifest, poll):
+        """
+        Runs jobs with at most `workers` processes, recording the frames
+        each one produced.
+        """
+        jobs = list(jobs)
+        running = []
+        while len(jobs) > 0 or len(running) > 0:
+            while len(jobs) > 0 and len(running) < self.workers:
+                mode, indices = jobs.pop(0)
+                proc = subprocess.Popen(self.command(mode, indices),
+                                        stdout = subprocess.DEVNULL)
+                running.append((proc, mode, indices))
+            time.sleep(poll)
+            still = []
+            for proc, mode, indices in running:
+                if proc.poll() is None:
+                    still.append((proc, mode, indices))
+                    continue
+                entry = manifest[mode]
+                for i in indices:
+                    path = self.frame_path(mode, i)
+                    if complete(path):
+                        entry['done'].append(i)
+                        continue
+                    # `render.py` skips existing frames, even partial ones
+                    if os.path.isfile(path):
+                        os.remove(path)
+                    key = str(i)
+                    entry['attempts'][key] = entry['attempts'].get(key, 0) + 1
+                self.save_manifest(manifest)
+            running = still
@@ -0,0 +1,196 @@
+"""
+Static stability analysis of towers.
+
+For every block, the combined center of mass of the block and everything it
+supports (its subtree in the tower graph) is tested against the support
+polygon formed by its contacts with its parents. The base is treated as an
+infinite plane, as in `tower_scene.TowerPhysics`.
+
+Margins are signed distances (in world units) from the subtree center of mass
+to the edge of the support polygon; positive margins are inside.
+"""
+
+import numpy as np
+import networkx as nx
+
+from blockworld.utils import math_2d
+from blockworld.towers import validation
+from blockworld.simulation import substances
+
+STABLE = 1
+UNSTABLE = 0
+UNKNOWN = -1
+
+def masses(tower, props = None):
+    """
+    Returns the mass of each block in a tower.
+
+    Densities are read from `props` (see `substances.tower_properties`)
+    if given. Blocks without a substance are given unit density.
+    """
+    keys = list(tower.blocks.keys())[1:]
+    if props is None:
+        props = substances.tower_properties(tower)
+    volume = np.array([np.prod(tower.blocks[k]['block'].dimensions)
+                       for k in keys])
+    return props['density'] * volume
+
+def structure(tower):
+    """
+    Extracts the block graph of a tower as arrays.
+
+    Returns:
+        A tuple of (dims, subtree, closed, parents).
+        - dims : `(blocks, 3)` block dimensions.
+        - subtree : `(blocks, blocks)` where `subtree[i, j]` is true if block
+            `j` rests (directly or indirectly) on block `i`, or `i == j`.
+        - closed : `(blocks,)` true if no block in the subtree of `i` is
+            also supported by a block outside of it.
+        - parents : List of parent indices for each block, with -1 denoting
+            the base.
+    """
+    g = tower.graph
+    keys = list(tower.blocks.keys())[1:]
+    index = {k : i for i, k in enumerate(keys)}
+    index[0] = -1
+    n = len(keys)
+    dims = np.array([tower.blocks[k]['block'].dimensions for k in keys])
+    subtree = np.eye(n, dtype = bool)
+    closed = np.ones(n, dtype = bool)
+    parents = []
+    for i, k in enumerate(keys):
+        below = [index[p] for p in g.predecessors(k)]
+        parents.append(below)
+        desc = nx.descendants(g, k)
+        for d in desc:
+            subtree[i, index[d]] = True
+        inside = desc | {k}
+        closed[i] = all(set(g.predecessors(d)) <= inside for d in desc)
+    return dims, subtree, closed, parents
+
+def _polygon_margin(points, com):
+    """
+    Signed distance of `com` to the convex hull of `points`.
+    """
+    hull = np.array(math_2d.convex_hull_graham(np.round(points, 8)))
+    if len(hull) < 3:
+        return -np.inf
+    edges = np.roll(hull, -1, axis = 0) - hull
+    rel = com - hull
+    cross = edges[:, 0] * rel[:, 1] - edges[:, 1] * rel[:, 0]
+    return np.min(cross / np.linalg.norm(edges, axis = 1))
+
+def margins(tower, starts = None, mass = None, eps = 1E-6, struct = None):
+    """
+    Computes the support margin of each block.
+
+    Arguments:
+        tower (`Tower`): The tower to analyze.
+        starts (np.ndarray, optional): An `(n, blocks, 3)` array of block
+            positions to evaluate (see `physics.perturbations`). Defaults to
+            the positions in `tower`.
+        mass (np.ndarray, optional): Block masses. Defaults to `masses`.
+        struct (tuple, optional): The result of `structure(tower)`.
+
+    Returns:
+        An `(n, blocks)` array of signed margins.
+    """
+    if struct is None:
+        struct = structure(tower)
+    dims, subtree, _, parents = struct
+    if starts is None:
+        keys = list(tower.blocks.keys())[1:]
+        starts = np.array([[tower.blocks[k]['block'].pos for k in keys]])
+    starts = np.asarray(starts, dtype = float)
+    if mass is None:
+        mass = masses(tower)
+
+    # combined center of mass of every subtree, for every start
+    weighted = subtree * mass
+    com = np.einsum('ij,njk->nik', weighted, starts[:, :, :2])
+    com /= weighted.sum(axis = 1)[:, np.newaxis]
+
+    lo = starts[:, :, :2] - dims[:, :2] / 2.0
+    hi = starts[:, :, :2] + dims[:, :2] / 2.0
+    result = np.empty(starts.shape[:2])
+    for i, below in enumerate(parents):
+        if -1 in below:
+            c_lo, c_hi = lo[:, [i]], hi[:, [i]]
+        else:
+            c_lo = np.maximum(lo[:, [i]], lo[:, below])
+            c_hi = np.minimum(hi[:, [i]], hi[:, below])
+        # only contacts with positive area support the block
+        valid = np.all(c_hi - c_lo > eps, axis = -1)
+        rel_lo = com[:, i, np.newaxis] - c_lo
+        rel_hi = c_hi - com[:, i, np.newaxis]
+        if c_lo.shape[1] == 1:
+            m = np.minimum(rel_lo, rel_hi).min(axis = -1)[:, 0]
+            result[:, i] = np.where(valid[:, 0], m, -np.inf)
+            continue
+        for s in range(len(starts)):
+            pts = [(x0, y0, x1, y1) for (x0, y0), (x1, y1), v in
+                   zip(c_lo[s], c_hi[s], valid[s]) if v]
+            if len(pts) == 0:
+                result[s, i] = -np.inf
+                continue
+            pts = np.array(pts)
+            corners = np.concatenate([pts[:, [0, 1]], pts[:, [2, 1]],
+                                      pts[:, [2, 3]], pts[:, [0, 3]]])
+            result[s, i] = _polygon_margin(corners, com[s, i])
+    return result
+
+def changed(tower, starts = None, struct = None, eps = 1E-6):
+    """
+    Finds starts whose contacts differ from the tower graph.
+
+    Margins only account for the contacts of each block with its parents,
+    so they are meaningless if blocks interpenetrate (see
+    `validation.overlaps`) or rest on blocks other than their parents.
+
+    Returns:
+        An `(n,)` boolean array, true where blocks overlap or where the
+        blocks each block rests on are not its parents.
+    """
+    if struct is None:
+        struct = structure(tower)
+    dims, _, _, parents = struct
+    if starts is None:
+        keys = list(tower.blocks.keys())[1:]
+        starts = np.array([[tower.blocks[k]['block'].pos for k in keys]])
+    starts = np.asarray(starts, dtype = float)
+    n, b = starts.shape[:2]
+    # the base is row 0, as in `validation.boxes`
+    lo = np.empty((n, b + 1, 3))
+    hi = np.empty((n, b + 1, 3))
+    lo[:, 0] = (-np.inf, -np.inf, -1.0)
+    hi[:, 0] = (np.inf, np.inf, 0.0)
+    lo[:, 1:] = starts - dims / 2.0
+    hi[:, 1:] = starts + dims / 2.0
+    linked = np.zeros((b + 1, b + 1), dtype = bool)
+    for i, below in enumerate(parents):
+        linked[np.array(below, dtype = int) + 1, i + 1] = True
+    overlap = validation.overlaps(lo, hi, tol = eps).any(axis = (1, 2))
+    support = validation.supports(lo, hi, tol = eps)
+    return overlap | np.any(support != linked, axis = (1, 2))
+
+def classify(tower, starts = None, tol = 0.05, mass = None):
+    """
+    Pre-screens towers for stability without simulation.
+
+    A start is `STABLE` if every block's margin exceeds `tol`. It is
+    `UNSTABLE` if some block whose subtree shares no load with the rest of
+    the tower has a margin below `-tol`. Otherwise it is `UNKNOWN` and should
+    be simulated. Starts whose contacts differ from the tower graph (see
+    `changed`) are always `UNKNOWN`.
+
+    Returns:
+        An `(n,)` array of `STABLE`, `UNSTABLE` or `UNKNOWN`.
+    """
+    struct = structure(tower)
+    m = margins(tower, starts = starts, mass = mass, struct = struct)
+    closed = struct[2]
+    result = np.full(len(m), UNKNOWN)
+    result[np.all(m > tol, axis = -1)] = STABLE
+    result[np.any((m < -tol) & closed, axis = -1)] = UNSTABLE
+    result[changed(tower, starts = starts, struct = struct)] = UNKNOWN
+    return result
@@ -67,3 +67,108 @@ class Substance:
     def serialize(self):
         return {'density' : float(self.density),
                 'friction' : float(self.friction)}
+
+
+#-----------------------------------------------------------------------------#
+# Batch assignment
+
+# Record type of a material table
+dtype = np.dtype([('density', np.float64), ('friction', np.float64)])
+
+# Uniform ranges of unknown substances
+bounds = {
+    'density' : (1.0, 10.0),
+    'friction' : (0.1, 0.9),
+}
+
+class MaterialTable:
+
+    """
+    Physical properties of a set of materials, indexed by material code.
+
+    The code of a material is its position in `names`. Materials listed in
+    `substances.density` and `substances.friction` are known; the properties
+    of unknown materials are drawn from `bounds` each time they are
+    assigned, as with `Substance`.
+
+    Attributes:
+
+      - names ([str]): Material names.
+      - table (np.ndarray): Structured array of known properties, with
+        `nan` for unknown materials.
+      - known (np.ndarray): `bool` mask of known materials.
+    """
+
+    def __init__(self, names):
+        self.names = list(names)
+        self.known = np.array([n in density and n in friction
+                               for n in self.names], dtype = bool)
+        self.table = np.full(len(self.names), np.nan, dtype = dtype)
+        for i, n in enumerate(self.names):
+            if self.known[i]:
+                self.table[i] = (density[n], friction[n])
+
+    # Methods #
+
+    def codes(self, names):
+        """
+        Returns the codes of material names.
+        """
+        index = {n : i for i, n in enumerate(self.names)}
+        return np.array([index[n] for n in names], dtype = np.int64)
+
+    def sample(self, size, p = None):
+        """
+        Draws material codes of any shape at once.
+        """
+        return np.random.choice(len(self.names), size = size, p = p)
+
+    def properties(self, codes):
+        """
+        Returns the properties of each material code.
+
+        Unknown materials are given independently sampled properties.
+
+        Returns:
+            A structured array of `dtype` with the shape of `codes`.
+        """
+        codes = np.asarray(codes)
+        props = self.table[codes]
+        unknown = ~self.known[codes]
+        n = np.count_nonzero(unknown)
+        if n > 0:
+            for field, (lo, hi) in bounds.items():
+                props[field][unknown] = np.random.uniform(lo, hi, size = n)
+        return props
+
+    def serialize(self, props):
+        """
+        Returns the `Substance.serialize` form of each entry of `props`.
+        """
+        return [{'density' : float(d), 'friction' : float(f)}
+                for d, f in zip(props['density'].ravel(),
+                                props['friction'].ravel())]
+
+
+def tower_properties(tower):
+    """
+    Returns the structured array of block properties of a tower.
+
+    Substances are stored on the tower as dicts, the serialized form read
+    by `tower_scene.Loader` and saved datasets, so they are read block by
+    block here. Analyses call this once per tower and work on the array.
+
+    Blocks without a substance are given unit density and the default
+    friction of `tower_scene`.
+    """
+    keys = list(tower.blocks.keys())[1:]
+    props = np.empty(len(keys), dtype = dtype)
+    for i, k in enumerate(keys):
+        sub = tower.blocks[k].get('substance')
+        if isinstance(sub, dict):
+            props[i] = (sub['density'], sub['friction'])
+        elif sub in density:
+            props[i] = (density[sub], friction[sub])
+        else:
+            props[i] = (1.0, 0.5)
+    return props
@@ -2,6 +2,26 @@ import numpy as np
 import pybullet
 import pybullet_utils.bullet_client as bc
 
+from blockworld.utils import profiling
+
+# Physics fidelity presets, from fastest to most accurate.
+#
+# `time_step` is the number of physics steps per second; the remaining entries
+# are passed to `setPhysicsEngineParameter`. Every preset sets the same engine
+# parameters so that presets can be switched on a single client.
+presets = {
+    'standard' : {
+        'time_step' : 240,
+        'numSolverIterations' : 50,
+        'enableConeFriction' : 0,
+    },
+    'reference' : {
+        'time_step' : 960,
+        'numSolverIterations' : 150,
+        'enableConeFriction' : 1,
+    },
+}
+
 class Loader:
 
     """
@@ -35,15 +55,29 @@ class TowerPhysics:
 
     """
     Handles physics for block towers.
+
+    If a `utils.cache.Cache` is given, traces are stored in it keyed by the
+    block shapes, the current state of every body and the `get_trace`
+    parameters. On a cache hit the world is not stepped. The solver keeps
+    contacts between steps that the state does not describe, so the cache
+    is only used until the world is first stepped after it is built or
+    restored.
     """
 
-    def __init__(self, tower_json, loader = None):
+    def __init__(self, tower_json, loader = None, cache = None):
         if loader is None:
             loader = Loader()
         self.loader = loader
+        self.cache = cache
         self.client = bc.BulletClient(connection_mode=pybullet.DIRECT)
         self.world = tower_json
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.client.disconnect()
+
     #-------------------------------------------------------------------------#
     # Attributes
 
@@ -63,21 +97,132 @@ class TowerPhysics:
         return self._world
 
     @world.setter
+    @profiling.profile('TowerPhysics.world')
     def world(self, w):
         self.client.resetSimulation()
         block_d = {}
+        dynamics = {}
+        shapes = []
         for block in w:
             start = block['data']
             block_key = block['id']
             block_id = self.loader(block_key, start, self.client)
             block_d[block_key] = block_id
+            info = self.client.getDynamicsInfo(block_id, -1)
+            dynamics[block_key] = (info[0], info[1])
+            shapes.append((block_key, start.get('dims')))
 
         self._world = block_d
+        self._shapes = shapes
+        self._dynamics = dynamics
+        self._changed = set()
+        self._state = None
+        self._stepped = False
+
+    #-------------------------------------------------------------------------#
+    # State management
+
+    def snapshot(self):
+        """Saves the current world state.
+
+        Subsequent calls to `restore` return the world to this state without
+        recreating any bodies.
+        """
+        if not self._state is None:
+            self.client.removeState(self._state)
+        self._state = self.client.saveState()
+        return self._state
+
+    def restore(self):
+        """Restores the world to the last `snapshot`.
+
+        Poses, velocities and any dynamics altered with `set_masses` or
+        `set_frictions` are reverted. Contacts cached by the solver are
+        dropped as well, so that a restored world steps exactly as one
+        freshly built from the same state.
+        """
+        if self._state is None:
+            raise ValueError('No snapshot to restore')
+        p = self.client
+        p.restoreState(self._state)
+        for obj in self._changed:
+            mass, friction = self._dynamics[obj]
+            p.changeDynamics(self.world[obj], -1, mass = mass,
+                             lateralFriction = friction)
+        self._changed = set()
+        # `restoreState` keeps the contacts of the last trial, which warm
+        # start the solver. Changing collision filters re-adds each body to
+        # the broadphase, dropping them; the filters set by `createMultiBody`
+        # are then put back.
+        for obj_id in self.world.values():
+            p.setCollisionFilterGroupMask(obj_id, -1, 0, 0)
+        for obj, obj_id in self.world.items():
+            if self._dynamics[obj][0] == 0:
+                p.setCollisionFilterGroupMask(obj_id, -1, 2, -3)
+            else:
+                p.setCollisionFilterGroupMask(obj_id, -1, 1, -1)
+        self._stepped = False
+
+    def state(self):
+        """Returns the pose, velocity, mass and friction of every body.
+        """
+        p = self.client
+        result = []
+        for key, obj_id in self.world.items():
+            pos, rot = p.getBasePositionAndOrientation(obj_id)
+            lin, ang = p.getBaseVelocity(obj_id)
+            info = p.getDynamicsInfo(obj_id, -1)
+            result.append((key, pos, rot, lin, ang, info[0], info[1]))
+        return result
+
+    def _object_ids(self, objects):
+        for obj in objects:
+            if not obj in self.world.keys():
+                raise ValueError('Block {} not found'.format(obj))
+        return [self.world[obj] for obj in objects]
+
+    def set_positions(self, objects, positions):
+        """Moves the given objects to the given positions.
+
+        Orientations are reset to identity and velocities to zero.
+
+        Arguments:
+            objects ([str]): Keys of the objects to move.
+            positions (np.ndarray): An `(len(objects), 3)` array of positions.
+        """
+        positions = np.asarray(positions, dtype = float)
+        if positions.shape != (len(objects), 3):
+            raise ValueError('Positions must have shape ({0:d}, 3)'.format(
+                len(objects)))
+        object_ids = self._object_ids(objects)
+        p = self.client
+        rot = p.getQuaternionFromEuler([0, 0, 0])
+        for obj_id, pos in zip(object_ids, positions):
+            p.resetBasePositionAndOrientation(obj_id, pos.tolist(), rot)
+            p.resetBaseVelocity(obj_id, [0, 0, 0], [0, 0, 0])
+
+    def set_masses(self, objects, masses):
+        """Changes the masses of the given objects until the next `restore`.
+        """
+        for obj, obj_id, mass in zip(objects, self._object_ids(objects),
+                                     masses):
+            self.client.changeDynamics(obj_id, -1, mass = float(mass))
+            self._changed.add(obj)
+
+    def set_frictions(self, objects, frictions):
+        """Changes the frictions of the given objects until the next `restore`.
+        """
+        for obj, obj_id, f in zip(objects, self._object_ids(objects),
+                                  frictions):
+            self.client.changeDynamics(obj_id, -1, lateralFriction = float(f))
+            self._changed.add(obj)
 
     #-------------------------------------------------------------------------#
     # Methods
 
-    def get_trace(self, frames, objects, time_step = 240, fps = 60):
+    @profiling.profile('TowerPhysics.get_trace')
+    def get_trace(self, frames, objects, time_step = None, fps = 60,
+                  fidelity = 'standard'):
         """Obtains world state from simulation.
 
         Currently returns the position of each rigid body.
@@ -86,24 +231,33 @@ class TowerPhysics:
         Arguments:
             frames (int): Number of frames to simulate.
             objects ([str]): List of strings of objects to report
-            time_step (int, optional): Number of physics steps per second
+            time_step (int, optional): Number of physics steps per second.
+                Overrides the value of the `fidelity` preset.
             fps (int, optional): Number of frames to report per second.
+            fidelity (str, optional): One of the keys in `presets`.
         """
-        for obj in objects:
-            if not obj in self.world.keys():
-                raise ValueError('Block {} not found'.format(obj))
-        object_ids = [self.world[obj] for obj in objects]
+        if not fidelity in presets:
+            raise ValueError('Unknown fidelity {}'.format(fidelity))
+        params = dict(presets[fidelity])
+        preset_step = params.pop('time_step')
+        if time_step is None:
+            time_step = preset_step
+        if time_step < fps:
+            raise ValueError('`time_step` must be at least `fps`')
+
+        object_ids = self._object_ids(objects)
+
+        cached = not (self.cache is None or self._stepped)
+        if cached:
+            key = self.cache.key(self._shapes, self.state(), list(objects),
+                                 frames, time_step, fps, fidelity)
+            result = self.cache.get(key)
+            if not result is None:
+                return result
 
         p = self.client
-        p.setPhysicsEngineParameter(
-            # useSplitImpulse = 1,
-            # splitImpulsePenetrationThreshold = 0.9
-            fixedTimeStep = 1.0 / time_step,
-            # numSolverIterations = 100,
-            enableConeFriction = 0,
-            # contactERP = 0.2
-
-        )
+        p.setPhysicsEngineParameter(fixedTimeStep = 1.0 / time_step,
+                                    **params)
         p.setGravity(0, 0, -10)
 
         positions = np.zeros((frames, len(objects), 3))
@@ -111,17 +265,55 @@ class TowerPhysics:
 
         steps_per_frame = int(time_step / fps)
         total_steps = int(max(1, ((frames / fps) * time_step)))
-        for step in range(total_steps):
-            p.stepSimulation()
+        with profiling.span('TowerPhysics.step'):
+            for step in range(total_steps):
+                p.stepSimulation()
 
-            if step % steps_per_frame != 0:
-                continue
+                if step % steps_per_frame != 0:
+                    continue
 
-            for c, obj_id in enumerate(object_ids):
-                pos, rot = p.getBasePositionAndOrientation(obj_id)
-                frame = np.floor(step / steps_per_frame).astype(int)
-                positions[frame, c] = pos
-                rotations[frame, c] = rot
+                for c, obj_id in enumerate(object_ids):
+                    pos, rot = p.getBasePositionAndOrientation(obj_id)
+                    frame = np.floor(step / steps_per_frame).astype(int)
+                    positions[frame, c] = pos
+                    rotations[frame, c] = rot
+        profiling.count('TowerPhysics.steps', total_steps)
+        self._stepped = True
 
         result = {'position' : positions, 'rotation' : rotations}
+        if cached:
+            self.cache.put(key, result)
         return result
+
+    def get_traces(self, starts, frames, objects, masses = None,
+                   frictions = None, **kwargs):
+        """Lazily obtains one trace per set of starting positions.
+
+        The world is restored to its snapshot (taken now if there is none)
+        before each trial, so no bodies are recreated.
+
+        Arguments:
+            starts (np.ndarray): An `(n, len(objects), 3)` array of positions.
+            frames (int): Number of frames to simulate.
+            objects ([str]): List of strings of objects to move and report.
+            masses (np.ndarray, optional): Masses of `objects` for each trial.
+            frictions (np.ndarray, optional): Frictions of `objects` for each
+                trial.
+            **kwargs: Passed to `get_trace`.
+
+        Returns:
+            A generator over the `n` traces.
+        """
+        starts = np.asarray(starts)
+        if starts.ndim != 3:
+            raise ValueError('Starts must have shape (n, objects, 3)')
+        if self._state is None:
+            self.snapshot()
+        for start in starts:
+            self.restore()
+            self.set_positions(objects, start)
+            if not masses is None:
+                self.set_masses(objects, masses)
+            if not frictions is None:
+                self.set_frictions(objects, frictions)
+            yield self.get_trace(frames, objects, **kwargs)
@@ -0,0 +1,301 @@
+"""
+Compact storage for physics traces.
+"""
+
+import io
+import os
+import json
+import zlib
+import struct
+import zipfile
+
+import numpy as np
+
+# Default quantization steps (world units and quaternion components)
+scales = {
+    'position' : 1E-3,
+    'rotation' : 1E-4,
+}
+
+class Trace:
+
+    """
+    Compact container for the result of `TowerPhysics.get_trace`.
+
+    Fields are stored either as floats of `dtype` or, if `quantize` is set,
+    as `int16` multiples of the steps in `scales`.
+
+    Attributes:
+
+      - fields ([str]): Names of the stored fields.
+      - step (int): Only every `step`-th frame is kept.
+      - dtype (str): Float type of stored (or decoded) fields.
+      - quantize (bool): Whether fields are stored as integers.
+
+    Methods:
+      - serialize (self): Returns a `dict` of nested lists, as accepted by
+        `render.py`.
+    """
+
+    def __init__(self, trace, fields = None, dtype = 'float32', step = 1,
+                 quantize = False):
+        if fields is None:
+            fields = list(trace.keys())
+        step = int(step)
+        if step <= 0:
+            raise ValueError('`step` must be greater than 0')
+        self.step = step
+        self.dtype = np.dtype(dtype)
+        self.quantize = quantize
+        self._data = {}
+        for f in fields:
+            if not f in trace:
+                raise ValueError('Field {} not in trace'.format(f))
+            self._data[f] = self._encode(f, np.asarray(trace[f])[::step])
+
+    @classmethod
+    def from_arrays(cls, data, dtype = 'float32', step = 1, quantize = False):
+        """
+        Wraps already encoded arrays (see `TraceFile`).
+        """
+        trace = cls({}, fields = [], dtype = dtype, step = step,
+                    quantize = quantize)
+        trace._data = dict(data)
+        return trace
+
+    # Properties #
+
+    @property
+    def fields(self):
+        return list(self._data.keys())
+
+    @property
+    def nbytes(self):
+        return sum(v.nbytes for v in self._data.values())
+
+    @property
+    def arrays(self):
+        """
+        The stored (possibly quantized) arrays.
+        """
+        return self._data
+
+    # Methods #
+
+    def _encode(self, field, values):
+        if not self.quantize:
+            return values.astype(self.dtype)
+        if not field in scales:
+            raise ValueError('No quantization step for {}'.format(field))
+        q = np.round(values / scales[field])
+        info = np.iinfo(np.int16)
+        if q.size and (q.min() < info.min or q.max() > info.max):
+            raise ValueError('{} exceeds quantization range'.format(field))
+        return q.astype(np.int16)
+
+    def __getitem__(self, field):
+        values = self._data[field]
+        if self.quantize:
+            return (values * scales[field]).astype(self.dtype)
+        return values
+
+    def __contains__(self, field):
+        return field in self._data
+
+    def __len__(self):
+        if len(self._data) == 0:
+            return 0
+        return len(next(iter(self._data.values())))
+
+    def serialize(self):
+        return {f : self[f].tolist() for f in self.fields}
+
+
+class TraceWriter:
+
+    """
+    Append-only store of traces for many towers in one file.
+
+    The file is a zip archive where each trace is stored as uncompressed
+    `.npy` members under its key, whose central directory serves as the
+    index. Existing files are appended to.
+
+    The central directory is only written when the archive is closed.
+    Each trace is flushed to the file as it is written, and the central
+    directory is rewritten every `sync` traces so that the file can be read
+    while it grows. If the writing process dies, the file is left without a
+    valid index; it is rebuilt with `recover`, from the member headers of
+    every complete trace, when the file is next opened for writing.
+
+    Example:
+
+        with TraceWriter('traces.zip') as w:
+            w.write('tower_0', Trace(trace, quantize = True))
+    """
+
+    def __init__(self, path, compress = False, sync = 1000):
+        self.path = path
+        self.sync = sync
+        self._mode = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+        if os.path.isfile(path) and _damaged(path):
+            recover(path)
+        self._open()
+        self._keys = set(_keys(self._zip))
+
+    def _open(self):
+        self._zip = zipfile.ZipFile(self.path, mode = 'a',
+                                    compression = self._mode)
+        self._pending = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def write(self, key, trace):
+        """
+        Appends `trace` (a `Trace` or a `get_trace` result) under `key`.
+        """
+        key = str(key)
+        if '/' in key:
+            raise ValueError('Keys cannot contain "/"')
+        if key in self._keys:
+            raise ValueError('Trace {} already written'.format(key))
+        if not isinstance(trace, Trace):
+            trace = Trace(trace)
+        meta = {'step' : trace.step, 'quantize' : trace.quantize,
+                'dtype' : trace.dtype.str, 'fields' : trace.fields}
+        for f, values in trace.arrays.items():
+            buf = io.BytesIO()
+            np.lib.format.write_array(buf, values)
+            self._zip.writestr('{0!s}/{1!s}.npy'.format(key, f),
+                               buf.getvalue())
+        # written last so that partially written traces are not indexed
+        self._zip.writestr('{0!s}/meta.json'.format(key), json.dumps(meta))
+        self._zip.fp.flush()
+        self._keys.add(key)
+        self._pending += 1
+        if self.sync > 0 and self._pending >= self.sync:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the index of all traces so far to disk.
+
+        This rewrites the whole central directory and reads it back.
+        """
+        self._zip.close()
+        self._open()
+
+    def close(self):
+        self._zip.close()
+
+
+class TraceFile:
+
+    """
+    Read access to a file written by `TraceWriter`.
+
+    Traces are only read when accessed by key.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._zip = zipfile.ZipFile(path, mode = 'r')
+        self._index = _keys(self._zip)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def keys(self):
+        return list(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, key):
+        return str(key) in self._index
+
+    def __getitem__(self, key):
+        key = str(key)
+        if not key in self._index:
+            raise KeyError(key)
+        meta = json.loads(self._zip.read('{0!s}/meta.json'.format(key)))
+        data = {}
+        for f in meta['fields']:
+            name = '{0!s}/{1!s}.npy'.format(key, f)
+            with self._zip.open(name) as member:
+                data[f] = np.lib.format.read_array(io.BytesIO(member.read()))
+        return Trace.from_arrays(data, dtype = meta['dtype'],
+                                 step = meta['step'],
+                                 quantize = meta['quantize'])
+
+    def close(self):
+        self._zip.close()
+
+
+def recover(path):
+    """
+    Rewrites an archive whose index was lost with the complete traces it
+    contains, found by scanning its member headers.
+
+    Returns:
+        The keys of the recovered traces.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    members = {}
+    i = 0
+    while data[i:i + 4] == b'PK\x03\x04' and i + 30 <= len(data):
+        (_, _, _, method, _, _, crc, size, _, n_name,
+         n_extra) = struct.unpack('<IHHHHHIIIHH', data[i:i + 30])
+        start = i + 30 + n_name + n_extra
+        if start + size > len(data):
+            break
+        name = data[i + 30:i + 30 + n_name].decode('utf-8')
+        raw = data[start:start + size]
+        if method == zipfile.ZIP_DEFLATED:
+            raw = zlib.decompress(raw, -15)
+        if zlib.crc32(raw) != crc:
+            break
+        members[name] = raw
+        i = start + size
+
+    keys = [n[:-len('/meta.json')] for n in members
+            if n.endswith('/meta.json')]
+    tmp = path + '.tmp'
+    with zipfile.ZipFile(tmp, mode = 'w') as zf:
+        for key in keys:
+            meta = json.loads(members['{0!s}/meta.json'.format(key)])
+            for f in meta['fields']:
+                name = '{0!s}/{1!s}.npy'.format(key, f)
+                zf.writestr(name, members[name])
+            zf.writestr('{0!s}/meta.json'.format(key),
+                        members['{0!s}/meta.json'.format(key)])
+    os.replace(tmp, path)
+    return keys
+
+def _damaged(path):
+    """
+    Returns `True` if the archive's index cannot be read.
+
+    An append session writes over the previous central directory, so a
+    file whose writer died can still end with the old end record and pass
+    `zipfile.is_zipfile`.
+    """
+    try:
+        zipfile.ZipFile(path, mode = 'r').close()
+    except zipfile.BadZipFile:
+        return True
+    return False
+
+def _keys(zf):
+    """
+    Returns the keys of complete traces in an archive.
+    """
+    return [n[:-len('/meta.json')] for n in zf.namelist()
+            if n.endswith('/meta.json')]
@@ -7,9 +7,18 @@ import networkx as nx
 
 from blockworld import blocks
 from blockworld.towers.tower import Tower
+from blockworld.towers import validation
+from blockworld.utils import profiling
 from blockworld.utils.json_encoders import TowerEncoder
 
-def load(json_file):
+@profiling.profile('simple_tower.load')
+def load(json_file, validate = False):
+    """
+    Loads a serialized tower from a path or a list.
+
+    If `validate` is set, raises a `ValueError` if blocks overlap, float or
+    disagree with their parents (see `validation.validate`).
+    """
 
     if isinstance(json_file, str):
         with open(json_file, 'r') as f:
@@ -27,7 +36,10 @@ def load(json_file):
         del block['data']['dims']
 
     g = nx.readwrite.json_graph.jit_graph(d, create_using=nx.DiGraph())
-    return SimpleTower(g)
+    tower = SimpleTower(g)
+    if validate:
+        validation.check(tower)
+    return tower
 
 class SimpleTower(Tower):
 
@@ -152,6 +164,7 @@ class SimpleTower(Tower):
         """
         return True
 
+    @profiling.profile('SimpleTower.serialize')
     def serialize(self, indent = None):
         """Return data in JIT JSON format.
         Parameters
@@ -0,0 +1,165 @@
+"""
+Vectorized checks of tower geometry.
+
+Blocks are treated as axis aligned boxes. For a tower of `n` blocks (the
+base included, at index 0) two `(n, n)` matrices are computed at once:
+
+- overlap[i, j]: blocks `i` and `j` interpenetrate by more than `tol`
+- support[i, j]: block `j` rests on block `i`
+
+The base is an infinite plane, as in `tower_scene.TowerPhysics`: any block
+sitting at `z = 0` rests on it and any block reaching below it overlaps it.
+
+Towers may be given as `SimpleTower`s or in their serialized form, so
+datasets can be checked before `simple_tower.load`.
+
+Example:
+
+    for report in validate_batch(towers):
+        if not report['valid']:
+            print(report)
+"""
+
+import numpy as np
+
+def boxes(tower):
+    """
+    Extracts the geometry of a tower as arrays.
+
+    Arguments:
+        tower (`SimpleTower` or list): A tower or its serialized form.
+
+    Returns:
+        A tuple of (ids, lo, hi, edges).
+        - ids : Sorted block ids, the base (0) first.
+        - lo, hi : `(n, 3)` lower and upper corners of each block.
+        - edges : `(parent, child)` id pairs of the tower graph.
+    """
+    if isinstance(tower, list):
+        nodes = sorted(tower, key = lambda d : d['id'])
+        ids = [d['id'] for d in nodes]
+        pos = [d['data']['pos'] for d in nodes[1:]]
+        dims = [d['data']['dims'] for d in nodes[1:]]
+        edges = [(d['id'], a['nodeTo']) for d in nodes
+                 for a in d.get('adjacencies', [])]
+    else:
+        ids = sorted(tower.blocks)
+        bs = [tower.blocks[k]['block'] for k in ids[1:]]
+        pos = [b.pos for b in bs]
+        dims = [b.dimensions for b in bs]
+        edges = list(tower.graph.edges())
+    pos = np.asarray(pos, dtype = float).reshape(-1, 3)
+    dims = np.asarray(dims, dtype = float).reshape(-1, 3)
+    lo = np.concatenate([[[-np.inf, -np.inf, -1.0]], pos - dims / 2.0])
+    hi = np.concatenate([[[np.inf, np.inf, 0.0]], pos + dims / 2.0])
+    return ids, lo, hi, edges
+
+def _extents(lo, hi):
+    """
+    Returns the `(..., n, n, 3)` extents of the pairwise intersections.
+    """
+    return (np.minimum(hi[..., :, np.newaxis, :], hi[..., np.newaxis, :, :]) -
+            np.maximum(lo[..., :, np.newaxis, :], lo[..., np.newaxis, :, :]))
+
+def overlaps(lo, hi, tol = 1E-6):
+    """
+    Returns the `(..., n, n)` matrix of interpenetrating pairs.
+
+    Blocks that only touch, within `tol`, do not overlap. Padded rows
+    of `nan` overlap nothing.
+    """
+    ext = _extents(lo, hi)
+    with np.errstate(invalid = 'ignore'):
+        result = np.all(ext > tol, axis = -1)
+    n = lo.shape[-2]
+    result[..., np.arange(n), np.arange(n)] = False
+    return result
+
+def supports(lo, hi, tol = 1E-6):
+    """
+    Returns the `(..., n, n)` matrix where `[i, j]` is true if block `j`
+    rests on block `i`: the bottom of `j` is within `tol` of the top of `i`
+    and their faces share a positive area.
+    """
+    ext = _extents(lo, hi)
+    with np.errstate(invalid = 'ignore'):
+        faces = np.all(ext[..., :2] > tol, axis = -1)
+        gap = np.abs(lo[..., np.newaxis, :, 2] - hi[..., :, np.newaxis, 2])
+        return faces & (gap <= tol)
+
+def _report(ids, overlap, support, edges):
+    """
+    Lists the violations of one tower by block id.
+    """
+    n = len(ids)
+    overlap = overlap[:n, :n]
+    support = support[:n, :n]
+    index = {k : i for i, k in enumerate(ids)}
+    linked = np.zeros((n, n), dtype = bool)
+    for p, c in edges:
+        linked[index[p], index[c]] = True
+    pairs = lambda m : [(ids[i], ids[j]) for i, j in zip(*np.nonzero(m))]
+    report = {
+        'overlaps' : pairs(np.triu(overlap)),
+        'floating' : [ids[j] for j in np.nonzero(~support.any(axis = 0))[0]
+                      if j > 0],
+        'missing_parents' : pairs(support & ~linked),
+        'extra_parents' : pairs(linked & ~support),
+    }
+    # blocks slid under an overhang are not linked to it by builders
+    report['valid'] = not any(len(report[k]) > 0 for k in
+                              ('overlaps', 'floating', 'extra_parents'))
+    return report
+
+def validate(tower, tol = 1E-6):
+    """
+    Checks a tower for interpenetrating blocks, floating blocks and parents
+    in the tower graph that disagree with the geometry.
+
+    A tower is valid without overlaps, floating blocks or `extra_parents`
+    (parents the block does not rest on). `missing_parents` are reported
+    but allowed, since a block placed under the overhang of an earlier one
+    is not made its parent.
+
+    Arguments:
+        tower (`SimpleTower` or list): A tower or its serialized form.
+        tol (float): Distance within which blocks are in contact.
+
+    Returns:
+        A `dict` with the id pairs `overlaps`, `missing_parents` and
+        `extra_parents`, the ids of `floating` blocks and whether the tower
+        is `valid`.
+    """
+    return validate_batch([tower], tol = tol)[0]
+
+def validate_batch(towers, tol = 1E-6):
+    """
+    Validates several towers at once, padding them to the same size.
+
+    Returns:
+        A list of reports, as `validate`.
+    """
+    data = [boxes(t) for t in towers]
+    if len(data) == 0:
+        return []
+    n = max(len(ids) for ids, _, _, _ in data)
+    lo = np.full((len(data), n, 3), np.nan)
+    hi = np.full((len(data), n, 3), np.nan)
+    for t, (ids, l, h, _) in enumerate(data):
+        lo[t, :len(ids)] = l
+        hi[t, :len(ids)] = h
+    overlap = overlaps(lo, hi, tol = tol)
+    support = supports(lo, hi, tol = tol)
+    return [_report(ids, overlap[t], support[t], edges)
+            for t, (ids, _, _, edges) in enumerate(data)]
+
+def check(tower, tol = 1E-6):
+    """
+    Raises a `ValueError` describing the violations of an invalid tower.
+    """
+    report = validate(tower, tol = tol)
+    if not report['valid']:
+        problems = ['{0!s}: {1!s}'.format(k, report[k]) for k in
+                    ('overlaps', 'floating', 'extra_parents')
+                    if len(report[k]) > 0]
+        raise ValueError('Invalid tower ({})'.format(', '.join(problems)))
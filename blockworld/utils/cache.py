@@ -0,0 +1,128 @@
+import os
+import json
+import pickle
+import hashlib
+import tempfile
+
+from blockworld.utils.json_encoders import TowerEncoder
+
+class Cache:
+
+    """
+    Persistent, content-addressed cache of simulation results.
+
+    Entries are pickled to files in `path` named by the hash of their key.
+    When the total size exceeds `max_size` bytes, the least recently used
+    entries are evicted. Entries are written atomically, so a cache directory
+    can be shared between processes.
+
+    Attributes:
+
+      - path (str): Directory holding the entries.
+      - max_size (int): Maximum total size of the entries in bytes.
+      - hits (int): Number of successful lookups.
+      - misses (int): Number of failed lookups.
+
+    Example:
+
+        cache = Cache('.blockworld_cache')
+        key = cache.key(tower.serialize(), frames)
+        trace = cache.get(key)
+        if trace is None:
+            trace = simulate(...)
+            cache.put(key, trace)
+    """
+
+    suffix = '.pkl'
+
+    def __init__(self, path, max_size = 1E9):
+        self.path = path
+        self.max_size = int(max_size)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.hits = 0
+        self.misses = 0
+        self._size = sum(os.path.getsize(f) for f in self._entries())
+
+    # Properties #
+
+    @property
+    def size(self):
+        return self._size
+
+    # Methods #
+
+    def key(self, *parts):
+        """
+        Returns the hash of the JSON serialization of `parts`.
+        """
+        s = json.dumps(parts, sort_keys = True, cls = TowerEncoder)
+        return hashlib.sha1(s.encode('utf-8')).hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.path, key + self.suffix)
+
+    def _entries(self):
+        return [os.path.join(self.path, f) for f in os.listdir(self.path)
+                if f.endswith(self.suffix)]
+
+    def __contains__(self, key):
+        return os.path.isfile(self._file(key))
+
+    def get(self, key, default = None):
+        """
+        Returns the value stored under `key`, marking it as recently used.
+        """
+        f = self._file(key)
+        try:
+            with open(f, 'rb') as fh:
+                value = pickle.load(fh)
+            os.utime(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """
+        Stores `value` under `key`, evicting old entries if needed.
+        """
+        f = self._file(key)
+        fd, tmp = tempfile.mkstemp(dir = self.path)
+        with os.fdopen(fd, 'wb') as fh:
+            pickle.dump(value, fh, protocol = pickle.HIGHEST_PROTOCOL)
+        if os.path.isfile(f):
+            self._size -= os.path.getsize(f)
+        os.replace(tmp, f)
+        self._size += os.path.getsize(f)
+        if self._size > self.max_size:
+            self.evict()
+
+    def evict(self):
+        """
+        Removes least recently used entries until within `max_size`.
+        """
+        entries = []
+        for f in self._entries():
+            try:
+                st = os.stat(f)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, f))
+        entries.sort()
+        size = sum(e[1] for e in entries)
+        for _, s, f in entries:
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(f)
+            except OSError:
+                pass
+            size -= s
+        self._size = size
+
+    def clear(self):
+        for f in self._entries():
+            os.remove(f)
+        self._size = 0
@@ -2,18 +2,33 @@ import numpy as np
 from shapely import geometry, affinity
 
 
-def make_grid(block, step = 0.1):
+def grid_points(block, step = 0.1):
+    """
+    Returns the `(n, 2)` array of grid points over a block's surface.
+    """
     bbox = block.surface.bounds
     xs = np.arange(bbox[0], bbox[2] + step, step)
     ys = np.arange(bbox[1], bbox[3] + step, step)
     grid = np.array(np.meshgrid(xs, ys)).T.reshape(-1, 2)
-    grid = np.round(grid, 2)
-    return geometry.MultiPoint(grid)
+    return np.round(grid, 2)
+
+def make_grid(block, step = 0.1):
+    return geometry.MultiPoint(grid_points(block, step = step))
+
+def in_bounds(points, bounds):
+    """
+    Returns a mask of the points within (or on) `(minx, miny, maxx, maxy)`.
+    """
+    return ((points[:, 0] >= bounds[0]) & (points[:, 0] <= bounds[2]) &
+            (points[:, 1] >= bounds[1]) & (points[:, 1] <= bounds[3]))
 
 def propose_placements(block, grid, z):
     """
     Returns a mapping of a block to each point in the grid.
     """
+    # intersections with a single point are not collections
+    if isinstance(grid, geometry.Point):
+        grid = [grid]
     f = lambda point : block.moveto(point, z)
     return list(map(f, grid))
 
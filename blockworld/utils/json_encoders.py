@@ -8,6 +8,8 @@ class TowerEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, np.ndarray):
             return obj.tolist()
+        elif isinstance(obj, np.generic):
+            return obj.item()
         elif isinstance(obj, SimpleBlock):
             return obj.serialize()
         return json.JSONEncoder.default(self, obj)
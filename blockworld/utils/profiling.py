@@ -0,0 +1,161 @@
+"""
+Opt-in instrumentation of the hot paths in blockworld.
+
+Timings are only recorded between `enable()` and `disable()`; otherwise each
+instrumented call costs a single flag check.
+
+Example:
+
+    from blockworld.utils import profiling
+    profiling.enable()
+    ...
+    pprint.pprint(profiling.stats())
+    profiling.chrome_trace('trace.json')
+"""
+
+import os
+import json
+import time
+import functools
+import threading
+from collections import defaultdict
+
+_enabled = False
+_events = []
+_counters = defaultdict(int)
+_origin = time.perf_counter()
+
+def enable():
+    global _enabled
+    _enabled = True
+
+def disable():
+    global _enabled
+    _enabled = False
+
+def is_enabled():
+    return _enabled
+
+def reset():
+    """
+    Discards all recorded events and counters.
+    """
+    global _origin
+    del _events[:]
+    _counters.clear()
+    _origin = time.perf_counter()
+
+
+class _Span:
+
+    """
+    Records the duration of a block of code as an event.
+    """
+
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *_):
+        end = time.perf_counter()
+        _events.append((self.name, self.start, end, threading.get_ident()))
+
+
+class _NullSpan:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        pass
+
+_null = _NullSpan()
+
+def span(name):
+    """
+    Context manager timing the enclosed block under `name`.
+    """
+    if not _enabled:
+        return _null
+    return _Span(name)
+
+def profile(name):
+    """
+    Decorator timing each call of a function under `name`.
+    """
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return f(*args, **kwargs)
+            with _Span(name):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def count(name, n = 1):
+    """
+    Increments the counter `name` by `n`.
+    """
+    if _enabled:
+        _counters[name] += n
+
+#-----------------------------------------------------------------------------#
+# Export
+
+def stats():
+    """
+    Aggregates recorded events.
+
+    Returns:
+        A `dict` with a 'timings' entry mapping each name to its number of
+        calls and total, mean and max durations (in seconds), and a
+        'counters' entry with the counter values.
+    """
+    timings = {}
+    for name, start, end, _ in list(_events):
+        dur = end - start
+        t = timings.setdefault(name, {'calls' : 0, 'total' : 0.0,
+                                      'max' : 0.0})
+        t['calls'] += 1
+        t['total'] += dur
+        t['max'] = max(t['max'], dur)
+    for t in timings.values():
+        t['mean'] = t['total'] / t['calls']
+    return {'timings' : timings, 'counters' : dict(_counters)}
+
+def chrome_trace(path = None):
+    """
+    Exports recorded events in the Chrome/Perfetto trace event format.
+
+    Arguments:
+        path (str, optional): File to write the JSON trace to.
+
+    Returns:
+        The trace as a `dict`.
+    """
+    pid = os.getpid()
+    events = []
+    for name, start, end, tid in list(_events):
+        events.append({
+            'name' : name,
+            'ph' : 'X',
+            'ts' : (start - _origin) * 1E6,
+            'dur' : (end - start) * 1E6,
+            'pid' : pid,
+            'tid' : tid,
+        })
+    ts = (time.perf_counter() - _origin) * 1E6
+    for name, value in _counters.items():
+        events.append({'name' : name, 'ph' : 'C', 'ts' : ts, 'pid' : pid,
+                       'args' : {name : value}})
+    trace = {'traceEvents' : events, 'displayTimeUnit' : 'ms'}
+    if not path is None:
+        with open(path, 'w') as f:
+            json.dump(trace, f)
+    return trace
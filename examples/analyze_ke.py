@@ -17,14 +17,15 @@ import numpy as np
 # from config import Config
 from blockworld import towers, blocks
 from blockworld.simulation import physics
+from blockworld.utils.cache import Cache
 
 # CONFIG = Config()
 
-def simulate_tower(tower, path):
+def simulate_tower(tower, path, cache = None):
     """
     Helper function that processes a tower.
     """
-    p = physics.TowerEntropy()
+    p = physics.TowerEntropy(cache = cache)
     t = towers.simple_tower.load(tower)
     return p(t)
 
@@ -34,8 +35,11 @@ def main():
         description = 'Renders the towers in a given directory')
     parser.add_argument('--src', type = str, default = 'towers',
                         help = 'Path to tower jsons')
+    parser.add_argument('--cache', type = str,
+                        help = 'Path to cache simulation results')
 
     args = parser.parse_args()
+    cache = None if args.cache is None else Cache(args.cache)
 
     # src = os.path.join(CONFIG['data'], args.src)
     src = args.src
@@ -44,7 +48,7 @@ def main():
         tower_name = os.path.splitext(os.path.basename(tower_j))[0]
         tower_base = os.path.join(out, tower_name)
         print('tower: {}'.format(tower_base))
-        ke = simulate_tower(tower_j, tower_base)
+        ke = simulate_tower(tower_j, tower_base, cache = cache)
         pprint.pprint(ke[0])
 
 if __name__ == '__main__':
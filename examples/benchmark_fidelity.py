@@ -0,0 +1,77 @@
+#!/bin/python3
+""" Compares physics fidelity presets on a corpus of towers.
+
+For each preset, reports simulations per second, the mean relative deviation
+of each tower's mean KE from the `reference` preset and the fraction of towers
+whose stability label (mean KE above `--threshold`) matches the reference.
+"""
+
+import os
+import time
+import glob
+import argparse
+import numpy as np
+
+from blockworld import towers
+from blockworld.simulation import physics, tower_scene
+from blockworld.simulation.generator import Generator
+
+
+def benchmark(tower_list, fidelity, samples, seed = 0):
+    """
+    Returns the mean KE of each tower and the simulations per second.
+    """
+    p = physics.TowerEntropy(samples = samples, fidelity = fidelity)
+    kes = []
+    start = time.time()
+    for i, tower in enumerate(tower_list):
+        # identical perturbations across presets
+        np.random.seed(seed + i)
+        kes.append(p.analyze(tower)[0])
+    elapsed = time.time() - start
+    return np.array(kes), (len(tower_list) * samples) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description = 'Benchmarks physics fidelity presets')
+    parser.add_argument('--src', type = str,
+                        help = 'Path to tower jsons')
+    parser.add_argument('--n', type = int, default = 10,
+                        help = 'Number of towers to generate without `--src`')
+    parser.add_argument('--b', type = int, default = 5,
+                        help = 'Size of generated towers')
+    parser.add_argument('--samples', type = int, default = 10,
+                        help = 'Perturbations per tower')
+    parser.add_argument('--threshold', type = float, default = 0.1,
+                        help = 'Mean KE above which a tower is unstable')
+    parser.add_argument('--presets', type = str, nargs = '+',
+                        default = list(tower_scene.presets.keys()),
+                        choices = list(tower_scene.presets.keys()))
+
+    args = parser.parse_args()
+
+    if args.src is None:
+        gen = Generator({'Wood' : 1.0}, 'local')
+        tower_list = [t for t, _ in gen((2,1), k = args.b, n = args.n)]
+    else:
+        tower_list = [towers.simple_tower.load(t) for t in
+                      glob.glob(os.path.join(args.src, '*.json'))]
+
+    results = {'reference' : benchmark(tower_list, 'reference', args.samples)}
+    ref_ke, _ = results['reference']
+    ref_labels = ref_ke > args.threshold
+
+    row = '{0!s:>10} {1:>10.1f} {2:>10.3f} {3:>10.3f}'
+    print('{0:>10} {1:>10} {2:>10} {3:>10}'.format(
+        'preset', 'sims/s', 'ke dev', 'agreement'))
+    for preset in args.presets:
+        if not preset in results:
+            results[preset] = benchmark(tower_list, preset, args.samples)
+        ke, rate = results[preset]
+        dev = np.mean(np.abs(ke - ref_ke) / np.maximum(ref_ke, 1E-12))
+        agreement = np.mean((ke > args.threshold) == ref_labels)
+        print(row.format(preset, rate, dev, agreement))
+
+if __name__ == '__main__':
+    main()
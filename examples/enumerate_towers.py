@@ -0,0 +1,44 @@
+#!/bin/python3
+""" Writes every distinct tower of up to `k` blocks as JSON lines.
+"""
+
+import json
+import argparse
+
+from blockworld.builders import SimpleBuilder, enumerator
+from blockworld.utils import json_encoders
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description = 'Enumerates all towers on a base')
+    parser.add_argument('k', type = int, help = 'Maximum number of blocks')
+    parser.add_argument('--base', type = float, nargs = 2, default = (2, 1),
+                        help = 'Dimensions of the base')
+    parser.add_argument('--step', type = float, default = 0.1,
+                        help = 'Grid resolution of placements')
+    parser.add_argument('--workers', type = int,
+                        help = 'Number of processes')
+    parser.add_argument('--depth', type = int, default = 1,
+                        help = 'Depth at which the search is split')
+    parser.add_argument('--towers', action = 'store_true',
+                        help = 'Write serialized towers instead of keys')
+    parser.add_argument('--out', type = str, default = 'towers.jsonl',
+                        help = 'Path to save towers')
+
+    args = parser.parse_args()
+
+    builder = SimpleBuilder(memo_size = 0, step = args.step)
+    enum = enumerator.TowerEnumerator(args.base, args.k, builder = builder)
+    n = 0
+    with open(args.out, 'w') as f:
+        for key in enum.run_parallel(workers = args.workers,
+                                     depth = args.depth):
+            if args.towers:
+                key = enumerator.build(args.base, key).serialize()
+            f.write(json.dumps(key, cls = json_encoders.TowerEncoder) + '\n')
+            n += 1
+    print('{0:d} towers'.format(n))
+
+if __name__ == '__main__':
+    main()
@@ -7,12 +7,133 @@ import glob
 import json
 import pprint
 import argparse
+import concurrent.futures
 
 import numpy as np
 import networkx as nx
 
 from blockworld import towers
 from blockworld.simulation.generator import Generator
+from blockworld.simulation.filters import Cascade
+from blockworld.utils import json_encoders
+
+materials = {'Wood' : 1.0}
+
+def write_atomic(path, text):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+def shard_path(out_d, shard):
+    return os.path.join(out_d, 'shard_{0:06d}.jsonl'.format(shard))
+
+def sample(gen, base, b, n, criteria = None):
+    """
+    Samples `n` towers, only keeping those that meet `criteria` (see
+    `filters.Cascade`) if given.
+
+    Returns:
+        A generator over towers and the cascade used, if any.
+    """
+    if criteria is None:
+        return gen(base, k = b, n = n), None
+    cascade = Cascade.from_dict(criteria)
+    return cascade.generate(gen, base, k = b, n = n), cascade
+
+def generate_shard(out_d, shard, start, n, b, base, seed, criteria = None):
+    """
+    Generates towers `start .. start + n - 1` into one shard file.
+
+    Each shard draws from its own seed, so its content does not depend on
+    which worker generates it or when.
+    """
+    np.random.seed([seed, shard])
+    if isinstance(base, str):
+        base = towers.simple_tower.load(base)
+    gen = Generator(materials, 'local')
+    lines = []
+    samples, cascade = sample(gen, base, b, n, criteria = criteria)
+    for i, (new_tower, _) in enumerate(samples):
+        record = {'index' : start + i, 'tower' : new_tower.serialize()}
+        lines.append(json.dumps(record, sort_keys = True,
+                                cls = json_encoders.TowerEncoder))
+    write_atomic(shard_path(out_d, shard), '\n'.join(lines) + '\n')
+    stats = None if cascade is None else cascade.stats
+    return shard, n, stats
+
+def load_shards(out_d):
+    """
+    Generator over `(index, serialized tower)` in a sharded dataset.
+    """
+    for path in sorted(glob.glob(os.path.join(out_d, 'shard_*.jsonl'))):
+        with open(path, 'r') as f:
+            for line in f:
+                record = json.loads(line)
+                yield record['index'], record['tower']
+
+def generate_sharded(out_d, n, b, base, shard_size, workers, seed,
+                     criteria = None):
+    """
+    Generates `n` towers in shards of `shard_size`, resuming from the
+    manifest in `out_d` if there is one.
+    """
+    if not isinstance(base, str):
+        # as read back from the manifest
+        base = list(base)
+    params = {'n' : n, 'b' : b, 'base' : base, 'shard_size' : shard_size,
+              'seed' : seed, 'criteria' : criteria}
+    manifest_path = os.path.join(out_d, 'manifest.json')
+    manifest = {'params' : params, 'done' : {}, 'filters' : {}}
+    if os.path.isfile(manifest_path):
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+        if manifest['params'] != params:
+            raise ValueError('{} was generated with {}'.format(
+                out_d, manifest['params']))
+
+    shards = []
+    for shard, start in enumerate(range(0, n, shard_size)):
+        # shard files only appear once complete
+        if os.path.isfile(shard_path(out_d, shard)):
+            manifest['done'][str(shard)] = min(shard_size, n - start)
+        else:
+            manifest['done'].pop(str(shard), None)
+            shards.append((shard, start, min(shard_size, n - start)))
+    write_atomic(manifest_path, json.dumps(manifest, indent = 4))
+    print('{0:d} of {1:d} shards remaining'.format(
+        len(shards), len(shards) + len(manifest['done'])))
+
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        futures = [executor.submit(generate_shard, out_d, shard, start, k,
+                                   b, base, seed, criteria = criteria)
+                   for shard, start, k in shards]
+        for f in concurrent.futures.as_completed(futures):
+            shard, k, stats = f.result()
+            manifest['done'][str(shard)] = k
+            if not stats is None:
+                manifest['filters'][str(shard)] = stats
+            write_atomic(manifest_path, json.dumps(manifest, indent = 4))
+
+    if not criteria is None:
+        print_rejections(manifest['filters'].values())
+
+def print_rejections(stats):
+    """
+    Prints the rejection rate of each `Cascade` stage over several runs.
+    """
+    total = {}
+    for s in stats:
+        for stage, v in s.items():
+            t = total.setdefault(stage, [0, 0, 0.0])
+            t[0] += v['seen']
+            t[1] += v['rejected']
+            t[2] += v['time']
+    for stage, (seen, rejected, t) in total.items():
+        if seen == 0:
+            continue
+        print('{0!s}: rejected {1:d} of {2:d} ({3:.1%}), {4:.3f}s'.format(
+            stage, rejected, seen, rejected / seen, t))
 
 
 def main():
@@ -24,6 +145,16 @@ def main():
                         default = 'towers')
     parser.add_argument('--base', type = str,
                         help = 'Path to base tower.')
+    parser.add_argument('--shard_size', type = int,
+                        help = 'Write towers in resumable shards of ' +\
+                        'this size instead of one file per tower')
+    parser.add_argument('--workers', type = int, default = 1,
+                        help = 'Number of processes generating shards')
+    parser.add_argument('--seed', type = int, default = 0,
+                        help = 'Random seed for sharded generation')
+    parser.add_argument('--criteria', type = json.loads,
+                        help = 'Acceptance criteria as a JSON object of ' +\
+                        '`filters.Cascade` arguments')
 
     args = parser.parse_args()
     out_d = args.out
@@ -39,15 +170,25 @@ def main():
     if not os.path.isdir(out_d):
         os.mkdir(out_d)
 
-    materials = {'Wood' : 1.0}
+    if not args.shard_size is None:
+        base = base if args.base is None else args.base
+        generate_sharded(out_d, args.n, args.b, base, args.shard_size,
+                         args.workers, args.seed, criteria = args.criteria)
+        return
+
     gen = Generator(materials, 'local')
 
-    for i, (new_tower, alt) in enumerate(gen(base, k = args.b, n = args.n)):
+    samples, cascade = sample(gen, base, args.b, args.n,
+                              criteria = args.criteria)
+    for i, (new_tower, alt) in enumerate(samples):
         base_name = 'blocks_{0:d}_tower_{1:d}_base_{2!s}.json'
         base_name = base_name.format(len(new_tower), i, base_path)
         out = os.path.join(out_d, base_name)
         with open(out, 'w') as f:
             json.dump(new_tower.serialize(), f, indent=4, sort_keys = True)
+    if not cascade is None:
+        print_rejections([cascade.stats])
+    print('placement memo hit rate: {0:.1%}'.format(gen.builder.hit_rate))
 
 if __name__ == '__main__':
     main()
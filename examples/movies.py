@@ -1,38 +1,32 @@
 import os
-import shlex
+import glob
 import argparse
-import subprocess
 
-import numpy as np
+from matplotlib import image as mpimg
+
+from blockworld import towers
+from blockworld.simulation import jobs, movie, preview, tower_scene
 
 from config import Config
 CONFIG = Config()
 
-def ffmpeg(source, out, extend = 0, image = None):
-    cmd = ("ffmpeg -r 60 -i {0!s} -pix_fmt yuv420p -vcodec libx264 "+\
-           "{1!s}").format(source, out)
-    subprocess.run(shlex.split(cmd), check=True)
-    if extend > 0:
-        cmd = ('ffmpeg -i {0!s} -filter_complex ' +\
-               '\"[0]trim=0:2[a];[0]setpts=PTS-2/TB[b];[0][b]overlay[c];[a][c]concat\"' + \
-               ' {0!s} -y').format(out)
-        subprocess.run(shlex.split(cmd), check=True)
-
-    # if not image is None:
-    #     t = vframes * (1.0/60.0)
-    #     cmd = ('ffmpeg -i {0!s} -i {1!s} -filter_complex '+ \
-    #            '\"[0:v] [1:v] concat=n=2:v=1 [v] \" -c:v libx264 -strict -2 -map \"[v]\" ' +\
-    #            '{0!s} -y').format(out, image)
-    #     subprocess.run(shlex.split(cmd), check=True)
-        # cmd = ("ffmpeg -r 60 -i {0!s} -i {3!s} -filter_complex "+\
-        # "\"scale=trunc(in_w/2)*2:trunc(in_h/2)*2; " +\
-        # "\"[0:v][1:v] overlay=main_w/2-overlay_w/2-90:main_h/2-overlay_h/2-50:enable='between(t,{4!s}, {5!s})'\" "+\
-        # "\"[0:v][1:v] overlay=main_w/2-overlay_w/2-90:main_h/2-overlay_h/2-50:enable='between(t,{4!s}, {5!s})'\" "+\
-        # " \"geq=random(1)*255:128:128;aevalsrc=-2+random(0)\" " +\
-        # "-pix_fmt yuv420p -vcodec libx264 -vframes {1:d} {2!s}").format(
-        #     source, vframes, out, image, t - (2./60.), t)
-
-
+def stream(tower_j, out, frames = 120, extend = 0, image = None,
+           resolution = (256, 256)):
+    """
+    Simulates a tower and pipes its preview frames straight into ffmpeg,
+    without writing any images.
+    """
+    tower = towers.simple_tower.load(tower_j)
+    tower_s = tower.serialize()
+    with tower_scene.TowerPhysics(tower_s) as scene:
+        trace = scene.get_trace(frames, tower.ordered_blocks)
+    pv = preview.Preview(resolution = resolution)
+    pv.extent = pv.fit(tower_s)
+    if not image is None:
+        image = mpimg.imread(image)
+    with movie.MovieWriter(out, extend = extend, overlay = image) as m:
+        for frame in pv.frames(tower_s, trace):
+            m.write(frame)
 
 def main():
     parser = argparse.ArgumentParser(
@@ -40,6 +34,17 @@ def main():
 
     parser.add_argument('--src', type = str, default = 'towers',
                         help = 'Path to rendered frames')
+    parser.add_argument('--extend', type = float, default = 0,
+                        help = 'Seconds to hold the last frame')
+    parser.add_argument('--image', type = str,
+                        help = 'Image shown over the held frames')
+    parser.add_argument('--stream', action = 'store_true',
+                        help = 'Treat `src` as tower jsons and stream ' +\
+                        'previews into ffmpeg without writing frames')
+    parser.add_argument('--frames', type = int, default = 120,
+                        help = 'Frames to simulate with `--stream`')
+    parser.add_argument('--jobs', type = int, default = 1,
+                        help = 'Number of concurrent ffmpeg processes')
 
     args = parser.parse_args()
     src = os.path.join(CONFIG['data'], args.src)
@@ -50,6 +55,16 @@ def main():
     if not os.path.isdir(out):
         os.mkdir(out)
 
+    if args.stream:
+        for tower_j in glob.glob(os.path.join(src, '*.json')):
+            name = os.path.splitext(os.path.basename(tower_j))[0]
+            fp = os.path.join(out, '{0!s}.mp4'.format(name))
+            stream(tower_j, fp, frames = args.frames, extend = args.extend,
+                   image = args.image)
+        return
+
+    runner = jobs.JobRunner(concurrency = args.jobs,
+                            log_dir = os.path.join(out, 'logs'))
     towers = next(os.walk(src))[1]
     for tower in towers:
         video_types = next(os.walk(os.path.join(src, tower)))[1]
@@ -57,7 +72,13 @@ def main():
         for vt in video_types:
             fp = os.path.join(out, '{0!s}_{1!s}.mp4'.format(tower, vt))
             path_str = os.path.join(src, tower, vt, '%d.png')
-            ffmpeg(path_str, fp)
+            n = len(glob.glob(os.path.join(src, tower, vt, '*.png')))
+            runner.encode(path_str, fp, extend = args.extend,
+                          image = args.image, n_frames = n,
+                          name = '{0!s}_{1!s}'.format(tower, vt))
+    for job in runner.run():
+        if job.status != 'done':
+            print('{0!s}: {1!s}'.format(job.name, job.status))
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,51 @@
+#!/bin/python3
+""" Writes a contact sheet of quick previews for the towers in a directory.
+
+Unlike `generate_renders.py`, no Blender process is needed.
+"""
+
+import os
+import glob
+import argparse
+
+from blockworld import towers
+from blockworld.simulation import preview, tower_scene
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description = 'Previews the towers in a given directory')
+    parser.add_argument('--src', type = str, default = 'towers',
+                        help = 'Path to tower jsons')
+    parser.add_argument('--out', type = str, default = 'preview.png',
+                        help = 'Path to save the contact sheet')
+    parser.add_argument('--cols', type = int, default = 10,
+                        help = 'Towers per row')
+    parser.add_argument('--resolution', type = int, nargs = 2,
+                        default = (128, 128), help = 'Preview resolution')
+    parser.add_argument('--view', type = str, default = 'front',
+                        choices = list(preview.views.keys()))
+    parser.add_argument('--frames', type = int, default = 0,
+                        help = 'If > 0, show the last of this many frames '+\
+                        'of simulation')
+
+    args = parser.parse_args()
+
+    pv = preview.Preview(resolution = args.resolution, view = args.view)
+    images = []
+    for tower_j in sorted(glob.glob(os.path.join(args.src, '*.json'))):
+        tower = towers.simple_tower.load(tower_j)
+        tower_s = tower.serialize()
+        trace = None
+        frame = 0
+        if args.frames > 0:
+            with tower_scene.TowerPhysics(tower_s) as scene:
+                trace = scene.get_trace(args.frames, tower.ordered_blocks)
+            frame = args.frames - 1
+        images.append(pv.frame(tower_s, trace, frame = frame))
+
+    sheet = preview.contact_sheet(images, cols = args.cols)
+    preview.save_png(args.out, sheet)
+
+if __name__ == '__main__':
+    main()
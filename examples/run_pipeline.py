@@ -0,0 +1,60 @@
+#!/bin/python3
+""" Generates, simulates, analyzes and optionally renders towers in one pass.
+
+See `blockworld/simulation/pipeline.py`.
+"""
+
+import argparse
+import concurrent.futures
+
+from blockworld.simulation.pipeline import Pipeline
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description = 'Runs the tower pipeline')
+    parser.add_argument('n', type = int, help = 'Number of towers')
+    parser.add_argument('b', type = int, help = 'The size of each tower.')
+    parser.add_argument('--out', type = str, default = 'pipeline',
+                        help = 'Path to save results')
+    parser.add_argument('--workers', type = int, default = 4,
+                        help = 'Number of worker processes')
+    parser.add_argument('--in_flight', type = int,
+                        help = 'Maximum number of towers in progress')
+    parser.add_argument('--samples', type = int, default = 50,
+                        help = 'Perturbations per tower')
+    parser.add_argument('--alternates', action = 'store_true',
+                        help = 'Also analyze material alternates')
+    parser.add_argument('--render', action = 'store_true',
+                        help = 'Render each tower with Blender')
+    parser.add_argument('--dask', action = 'store_true',
+                        help = 'Run on a local Dask cluster')
+    parser.add_argument('--seed', type = int, default = 0)
+
+    args = parser.parse_args()
+
+    pipe = Pipeline(args.out, {'Wood' : 1.0}, k = args.b,
+                    entropy = {'samples' : args.samples},
+                    alternates = args.alternates,
+                    render = {} if args.render else None,
+                    max_in_flight = args.in_flight, seed = args.seed)
+
+    if args.dask:
+        from dask import distributed
+        cluster = distributed.LocalCluster(n_workers = args.workers,
+                                           threads_per_worker = 1)
+        print(cluster.dashboard_link)
+        executor = distributed.Client(cluster)
+    else:
+        executor = concurrent.futures.ProcessPoolExecutor(args.workers)
+
+    try:
+        for summary in pipe.run(args.n, executor = executor):
+            print('tower {0:d}: {1!s}'.format(summary['tower'],
+                                              summary['ke']))
+    finally:
+        # also stops the workers of a dask cluster
+        executor.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -20,8 +20,9 @@ from dask import distributed
 
 # from config import Config
 from blockworld import towers, blocks
-from blockworld.simulation import tower_scene
+from blockworld.simulation import tower_scene, traces
 from blockworld.utils import json_encoders
+from blockworld.utils.cache import Cache
 
 
 # CONFIG = Config()
@@ -30,9 +31,28 @@ render_path = 'blockworld/simulation/render.py'
 mat_path = 'blockworld/simulation/materials.blend'
 cmd = '/blender/blender --background -P {0!s}'
 
+def write_inputs(scene, trace, out):
+    """
+    Writes a scene json and a directory of `.npy` trace fields to `out`
+    for `render.py`.
+
+    Returns:
+        The paths of the scene file and trace directory.
+    """
+    scene_path = os.path.join(out, 'scene.json')
+    with open(scene_path, 'w') as f:
+        json.dump(scene, f, cls = json_encoders.TowerEncoder)
+    trace_path = os.path.join(out, 'trace')
+    if not os.path.isdir(trace_path):
+        os.mkdir(trace_path)
+    fields = trace.fields if isinstance(trace, traces.Trace) else trace.keys()
+    for field in fields:
+        np.save(os.path.join(trace_path, field + '.npy'),
+                np.asarray(trace[field]))
+    return scene_path, trace_path
+
 def render(scene, trace, out):
-    scene_s = json.dumps(scene)
-    trace_s = json.dumps(trace, cls = json_encoders.TowerEncoder)
+    scene_path, trace_path = write_inputs(scene, trace, out)
     _cmd = cmd.format(render_path)
     _cmd = shlex.split(_cmd)
     _cmd += [
@@ -41,32 +61,51 @@ def render(scene, trace, out):
         out,
         '--save_world',
         '--scene',
-        scene_s,
+        scene_path,
         '--trace',
-        trace_s,
+        trace_path,
+        '--mmap',
         '--render_mode',
         'none'
     ]
-    # _cmd = shlex.split(cmd.format(render_path, scene_s, trace_s, out))
-    # _cmd = ['/blender/blender',
-    #         '--background ',
-    #         '--python {}'.format(render_path),
-    #         '--scene {}'.format(scene_s),
-    #         '--trace {}'.format(trace_s),
-    #         '--out {}'.format(out)]
-    # print(' '.join(_cmd[:-3]))
     subprocess.run(_cmd)
 
-def simulate_tower(tower_j):
+def submit(spool, name, scene, trace, out, **options):
+    """
+    Queues a render job for `render.py --worker` processes.
+
+    The scene and trace are written to `out` and referenced by path.
+    `options` are any other `render.py` arguments, such as `render_mode`.
+    """
+    scene_path, trace_path = write_inputs(scene, trace, out)
+    job = dict(options, scene = scene_path, trace = trace_path, out = out,
+               mmap = True)
+    job_path = os.path.join(spool, name + '.json')
+    # written under another name so workers never see partial jobs
+    with open(job_path + '.tmp', 'w') as f:
+        json.dump(job, f)
+    os.rename(job_path + '.tmp', job_path)
+
+def start_workers(spool, n = 1):
+    """
+    Launches `n` Blender processes rendering the jobs in `spool`.
+    """
+    _cmd = shlex.split(cmd.format(render_path))
+    _cmd += ['--', '--worker', spool]
+    return [subprocess.Popen(_cmd) for _ in range(n)]
+
+def simulate_tower(tower_j, cache = None):
     """
     Helper function that processes a tower.
     """
     tower = towers.simple_tower.load(tower_j)
     tower_s = tower.serialize()
     keys = list(tower.blocks.keys())[1:]
-    with tower_scene.TowerPhysics(tower_s) as scene:
+    if not cache is None:
+        cache = Cache(cache)
+    with tower_scene.TowerPhysics(tower_s, cache = cache) as scene:
         trace = scene.get_trace(120, keys)
-    return trace
+    return traces.Trace(trace)
 
 
 def main():
@@ -74,6 +113,13 @@ def main():
         description = 'Renders the towers in a given directory')
     parser.add_argument('--src', type = str, default = 'data/towers',
                         help = 'Path to tower jsons')
+    parser.add_argument('--cache', type = str,
+                        help = 'Path to cache simulation results')
+    parser.add_argument('--spool', type = str,
+                        help = 'Render through persistent workers using ' +\
+                        'this spool directory')
+    parser.add_argument('--workers', type = int, default = 1,
+                        help = 'Number of render workers')
 
     args = parser.parse_args()
 
@@ -88,8 +134,25 @@ def main():
     client = distributed.Client(cluster)
 
     tower_jsons = glob.glob(os.path.join(src, '*.json'))
-    futures = client.map(simulate_tower, tower_jsons)
+    futures = client.map(simulate_tower, tower_jsons, cache = args.cache)
     results = client.gather(futures)
     print(results[0])
+
+    if not args.spool is None:
+        for d in (out, args.spool):
+            if not os.path.isdir(d):
+                os.mkdir(d)
+        for tower_j, trace in zip(tower_jsons, results):
+            name = os.path.splitext(os.path.basename(tower_j))[0]
+            tower_out = os.path.join(out, name)
+            if not os.path.isdir(tower_out):
+                os.mkdir(tower_out)
+            scene = towers.simple_tower.load(tower_j).serialize()
+            submit(args.spool, name, scene, trace, tower_out,
+                   save_world = True, render_mode = 'none')
+        open(os.path.join(args.spool, 'STOP'), 'w').close()
+        for w in start_workers(args.spool, n = args.workers):
+            w.wait()
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,65 @@
+#!/bin/python3
+""" Checks tower datasets for overlapping and floating blocks.
+"""
+
+import os
+import glob
+import json
+import argparse
+
+from blockworld.towers import validation
+
+
+def read(paths):
+    """
+    Generator over `(name, serialized tower)` in JSON files, JSON lines
+    files (as written by `generate_towers.py --shard_size` or
+    `enumerate_towers.py --towers`) and directories thereof.
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            files = sorted(glob.glob(os.path.join(path, '*.json')) +
+                           glob.glob(os.path.join(path, '*.jsonl')))
+            yield from read([f for f in files
+                             if not f.endswith('manifest.json')])
+        elif path.endswith('.jsonl'):
+            with open(path, 'r') as f:
+                for i, line in enumerate(f):
+                    record = json.loads(line)
+                    if isinstance(record, dict):
+                        i, record = record['index'], record['tower']
+                    yield '{0!s}:{1:d}'.format(path, i), record
+        else:
+            with open(path, 'r') as f:
+                yield path, json.load(f)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description = 'Validates the geometry of towers')
+    parser.add_argument('paths', type = str, nargs = '+',
+                        help = 'Tower files or directories')
+    parser.add_argument('--tol', type = float, default = 1E-6,
+                        help = 'Distance within which blocks are in contact')
+    parser.add_argument('--batch', type = int, default = 1024,
+                        help = 'Towers validated at once')
+
+    args = parser.parse_args()
+
+    total = 0
+    invalid = 0
+    towers = read(args.paths)
+    while True:
+        batch = [t for _, t in zip(range(args.batch), towers)]
+        if len(batch) == 0:
+            break
+        names, data = zip(*batch)
+        for name, report in zip(names, validation.validate_batch(
+                data, tol = args.tol)):
+            total += 1
+            if not report['valid']:
+                invalid += 1
+                print(name, report)
+    print('{0:d} of {1:d} towers invalid'.format(invalid, total))
+
+if __name__ == '__main__':
+    main()
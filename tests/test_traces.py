@@ -0,0 +1,69 @@
+#!/bin/python3
+
+import os
+import signal
+import argparse
+import tempfile
+import numpy as np
+
+from blockworld.simulation.traces import TraceWriter, TraceFile
+
+def trace(i):
+    return {'position' : np.full((10, 2, 3), i, dtype = float),
+            'rotation' : np.full((10, 2, 4), i, dtype = float)}
+
+def append_and_die(path, start, members):
+    """
+    Appends traces from `start` on and kills the process after `members`
+    archive members have been written.
+    """
+    pid = os.fork()
+    if pid > 0:
+        os.waitpid(pid, 0)
+        return
+    writer = TraceWriter(path)
+    writestr = writer._zip.writestr
+    count = [0]
+    def dying(*args, **kwargs):
+        writestr(*args, **kwargs)
+        count[0] += 1
+        if count[0] == members:
+            writer._zip.fp.flush()
+            os.kill(os.getpid(), signal.SIGKILL)
+    writer._zip.writestr = dying
+    for i in range(start, start + members):
+        writer.write(i, trace(i))
+    os._exit(1)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description = 'Tests recovery of `TraceWriter` archives')
+    parser.add_argument('--number', type = int, default = 300,
+                        help = 'Number of traces written before the crash.')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'traces.zip')
+        writer = TraceWriter(path)
+        for i in range(args.number):
+            writer.write(i, trace(i))
+        writer.close()
+
+        # three members per trace: two complete traces and one partial one
+        print('killing writer mid-append')
+        append_and_die(path, args.number, 7)
+
+        expected = [str(i) for i in range(args.number + 2)]
+        writer = TraceWriter(path)
+        assert sorted(writer._keys, key = int) == expected
+        writer.write(args.number + 2, trace(args.number + 2))
+        writer.close()
+
+        traces = TraceFile(path)
+        assert len(traces.keys()) == args.number + 3
+        for i in (0, args.number - 1, args.number + 1, args.number + 2):
+            assert np.all(traces[str(i)]['position'] == i)
+        print('recovered {0:d} traces'.format(len(traces.keys())))
+
+if __name__ == '__main__':
+    main()